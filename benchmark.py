@@ -0,0 +1,56 @@
+"""
+Runs the scripted simulation benchmarks (see project.benchmark) and prints the results as JSON.
+Examples:
+    python benchmark.py --output results.json
+    python benchmark.py --maps "The Rumble" --scenarios empty full --baseline results.json
+    python benchmark.py --headless  (no display and no decoded graphics, measures Board.update only)
+"""
+
+import os
+import sys
+import json
+import argparse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure how Board.update and Board.draw scale.')
+    parser.add_argument('--maps', nargs='+', help='map names from config.MAPS (default: all)')
+    parser.add_argument('--scenarios', nargs='+', help='empty, towers, barracks, mixed, full (default: all)')
+    parser.add_argument('--ticks', type=int, default=1000, help='measured ticks per scenario')
+    parser.add_argument('--warmup', type=int, default=500, help='ticks run before measuring, lets soldiers spawn')
+    parser.add_argument('--memory-ticks', type=int, default=200, help='ticks run while tracing allocations')
+    parser.add_argument('--barracks', type=int, default=2, help='barracks per player')
+    parser.add_argument('--towers', type=int, default=1, help='towers of each upgrade type per player')
+    parser.add_argument('--headless', action='store_true', help='skip drawing, run without graphics')
+    parser.add_argument('--soldier-engine', action='store_true', help='use the numpy soldier engine')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare the results against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown (default: 0.1)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.headless:
+        os.environ['RTS_HEADLESS'] = '1'
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # graphics are needed to draw, the window is not
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # keep stdout clean for the JSON
+
+    from project import config, benchmark
+    config.USE_SOLDIER_ENGINE = args.soldier_engine
+
+    report = benchmark.run(args.maps, args.scenarios, args.ticks, args.warmup, args.memory_ticks,
+                           args.barracks, args.towers, draw=not args.headless,
+                           log=lambda line: print(line, file=sys.stderr))
+    if args.output:
+        benchmark.save(report, args.output)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions, lines = benchmark.compare(report, benchmark.load(args.baseline), args.tolerance)
+        for line in lines:
+            print(line, file=sys.stderr)
+        if regressions:
+            print(f'{len(regressions)} rates dropped more than {args.tolerance:.0%}', file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,48 @@
+"""
+Runs a dedicated server (see project.dedicated). It needs no display, all the players join it as clients.
+With --matches it runs a match server instead (see project.matches): every match gets its own worker process,
+the players join a match by entering "ip/match_id" as the address.
+Examples:
+    python dedicated_server.py --map "The Rumble" --players 2
+    python dedicated_server.py --players 4 --tick-rate 30
+The simulation always runs at the game's fixed rate, the clients predict at the same one.
+--tick-rate sets the network tick: how many times per second the changes are broadcast.
+    python dedicated_server.py --matches 8 --port 6000
+"""
+
+import os
+import argparse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Host a match without a display.')
+    parser.add_argument('--map', help='map name from config.MAPS (default: the first one)')
+    parser.add_argument('--players', type=int, default=2, help='players the match starts with (default: 2)')
+    parser.add_argument('--tick-rate', type=float,
+                        help='state broadcasts per second (default: 1 / config.STATE_BROADCAST_TICK)')
+    parser.add_argument('--port', type=int, default=5555, help='port to listen on (default: 5555)')
+    parser.add_argument('--max-clients', type=int, default=4, help='players and spectators per match (default: 4)')
+    parser.add_argument('--matches', type=int, default=0,
+                        help='host up to this many matches at once, on the ports following --port')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.environ['RTS_HEADLESS'] = '1'  # no window, no fonts and no decoded graphics
+
+    from project import config, dedicated, matches
+    if args.tick_rate:
+        dedicated.set_broadcast_rate(args.tick_rate)
+
+    map_name = args.map or next(iter(config.MAPS))
+    if map_name not in config.MAPS:
+        raise SystemExit(f'Unknown map {map_name!r}, choose one of: {", ".join(config.MAPS)}')
+    castles = dedicated.get_player_count(config.MAPS[map_name])
+    if not 2 <= args.players <= min(castles, args.max_clients):
+        raise SystemExit(f'{map_name} is for 2 to {min(castles, args.max_clients)} players')
+
+    if args.matches:
+        matches.MatchServer(map_name, args.players, args.tick_rate, args.port, args.matches, args.max_clients).run()
+    else:
+        dedicated.DedicatedServer(map_name, args.players, args.port, args.max_clients).run()
@@ -0,0 +1,236 @@
+"""
+Scripted simulation benchmarks.
+Builds scenarios on every map from config.MAPS and measures how Board.update and Board.draw scale.
+Run it with the benchmark.py script from the repository's root directory.
+"""
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+import pygame as pg
+from project import config
+from project.components import Board, Path
+from project.dataclasses import MapConfig
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+SCENARIOS = ['empty', 'towers', 'barracks', 'mixed', 'full']
+TOWER_TYPES = ['tower', 'sniper_tower', 'magic_tower']
+FILLER_TYPES = ['market', 'mine', 'bank']
+GROUPS = ['tile_group', 'path_group', 'building_group', 'unit_group', 'bullet_group']
+FORTIFIED_HEALTH = 10 ** 6  # buildings don't fall, so the scenario stays in a steady state
+
+
+def get_player_count(layout):
+    return sum(char.isdigit() for char in layout)
+
+
+def find_path(start, goal):
+    """ Shortest list of tiles from start to goal moving up, down, left or right """
+    previous = {start: None}
+    queue = deque([start])
+    while queue:
+        tile = queue.popleft()
+        if tile is goal:
+            break
+        for direction in ('up', 'down', 'left', 'right'):
+            neighbour = tile.neighbours[direction]
+            if neighbour is not None and neighbour not in previous:
+                previous[neighbour] = tile
+                queue.append(neighbour)
+    if goal not in previous:
+        return []
+    path, tile = [], goal
+    while tile is not None:
+        path.append(tile)
+        tile = previous[tile]
+    return path[::-1]
+
+
+def divide_tiles(board, players):
+    """ Gives every tile to the player whose castle is the closest. Returns the free tiles of each player """
+    distance = {}
+    owners = {}
+    queue = deque()
+    for player in players.values():
+        distance[player.tile] = 0
+        owners[player.tile] = player
+        queue.append(player.tile)
+    while queue:
+        tile = queue.popleft()
+        for neighbour in tile.neighbours.values():
+            if neighbour is not None and neighbour not in distance:
+                distance[neighbour] = distance[tile] + 1
+                owners[neighbour] = owners[tile]
+                queue.append(neighbour)
+    free = {player_id: [] for player_id in players}
+    for tile in sorted(board.tiles.values(), key=lambda t: (distance.get(t, 0), t.index)):
+        if tile in owners and tile.building is None:
+            free[owners[tile].id].append(tile)
+    return free
+
+
+def place(board, tile, player, building_name):
+    tile.owner = player
+    board.build_on_tile(tile, building_name)
+    return tile.building
+
+
+def build_scenario(map_name, scenario, barracks=2, towers=1):
+    """
+    Creates a board with all the players of the map and builds the scenario on it.
+    :param barracks: number of barracks per player, each sending soldiers to the farthest enemy castle
+    :param towers: number of towers of each upgrade type per player
+    """
+    layout = config.MAPS[map_name]
+    board = Board()
+    players = board.initialize(MapConfig(player_no=get_player_count(layout), name=map_name, layout=layout))
+    free = divide_tiles(board, players)
+
+    for player in players.values():
+        tiles = free[player.id]
+        if scenario in ('barracks', 'mixed', 'full'):
+            enemies = [p.tile for p in players.values() if p is not player]
+            for tile in tiles[:barracks]:
+                building = place(board, tile, player, 'barracks')
+                target = max(enemies, key=lambda castle: len(find_path(tile, castle)))
+                path = Path(tile, player)
+                for path_tile in find_path(tile, target)[1:]:
+                    path.add_tile(path_tile)
+                building.set_path(path)
+            tiles = tiles[barracks:]
+        if scenario in ('towers', 'mixed', 'full'):
+            for i, tile in enumerate(tiles[:towers * len(TOWER_TYPES)]):
+                place(board, tile, player, TOWER_TYPES[i % len(TOWER_TYPES)])
+            tiles = tiles[towers * len(TOWER_TYPES):]
+        if scenario == 'full':
+            for i, tile in enumerate(tiles):
+                place(board, tile, player, FILLER_TYPES[i % len(FILLER_TYPES)])
+
+    for building in board.building_group.sprites():
+        building.max_health = building.health = FORTIFIED_HEALTH
+    return board, players
+
+
+def get_sprite_counts(board):
+    return {name: len(getattr(board, name)) for name in GROUPS}
+
+
+def measure(board, ticks, surface):
+    """ Steps and draws the board, returns the timings and the peak sprite counts """
+    update_time = draw_time = 0.0
+    peak = get_sprite_counts(board)
+    for _ in range(ticks):
+        start = time.perf_counter()
+        board.update()
+        update_time += time.perf_counter() - start
+        if surface is not None:
+            start = time.perf_counter()
+            board.draw(surface, 0)
+            draw_time += time.perf_counter() - start
+        for name, count in get_sprite_counts(board).items():
+            peak[name] = max(peak[name], count)
+    return update_time, draw_time, peak
+
+
+def run_scenario(map_name, scenario, ticks, warmup, memory_ticks, barracks, towers, draw):
+    surface = pg.Surface(config.SCREEN_SIZE) if draw else None
+    if surface is not None and pg.display.get_surface() is not None:
+        surface = surface.convert()
+
+    # python allocations are traced in a separate short run, tracing slows everything down
+    tracemalloc.start()
+    board, _ = build_scenario(map_name, scenario, barracks, towers)
+    measure(board, memory_ticks, surface)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    board.clear()
+
+    board, _ = build_scenario(map_name, scenario, barracks, towers)
+    measure(board, warmup, surface)
+    update_time, draw_time, peak = measure(board, ticks, surface)
+    board.clear()
+    return {
+        'ticks': ticks,
+        'update_ticks_per_sec': ticks / update_time if update_time else None,
+        'draw_frames_per_sec': ticks / draw_time if draw_time else None,
+        'update_ms_per_tick': update_time * 1000 / ticks,
+        'draw_ms_per_frame': draw_time * 1000 / ticks if draw else None,
+        'peak_sprites': peak,
+        'python_peak_kb': python_peak // 1024,
+    }
+
+
+def get_rss_peak_kb():
+    """ Peak resident memory of the whole process in kB, None if it can't be read """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS
+
+
+def run(maps=None, scenarios=None, ticks=1000, warmup=500, memory_ticks=200, barracks=2, towers=1, draw=True,
+        log=print):
+    results = {}
+    for map_name in maps or config.MAPS:
+        for scenario in scenarios or SCENARIOS:
+            key = f'{map_name}/{scenario}'
+            results[key] = run_scenario(map_name, scenario, ticks, warmup, memory_ticks, barracks, towers, draw)
+            log(f'{key}: {results[key]["update_ticks_per_sec"]:.0f} ticks/s, '
+                f'{results[key]["draw_frames_per_sec"] or 0:.0f} frames/s, '
+                f'{sum(results[key]["peak_sprites"].values())} peak sprites')
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pygame': pg.version.ver,
+            'headless': config.HEADLESS,
+            'soldier_engine': config.USE_SOLDIER_ENGINE,
+            'barracks': barracks,
+            'towers': towers,
+            'ticks': ticks,
+            'warmup': warmup,
+            'rss_peak_kb': get_rss_peak_kb(),  # of the whole process, the scenarios share it
+        },
+        'results': results,
+    }
+
+
+RATES = ['update_ticks_per_sec', 'draw_frames_per_sec']
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Compares the rates of the report with the baseline report.
+    Returns the list of (scenario, metric, baseline value, current value) of the rates which dropped
+    by more than the tolerance and the printable comparison lines.
+    """
+    regressions, lines = [], []
+    for key, result in report['results'].items():
+        old = baseline['results'].get(key)
+        if old is None:
+            lines.append(f'{key}: not in the baseline')
+            continue
+        for metric in RATES:
+            if not result.get(metric) or not old.get(metric):
+                continue
+            change = result[metric] / old[metric] - 1
+            lines.append(f'{key} {metric}: {old[metric]:.0f} -> {result[metric]:.0f} ({change:+.1%})')
+            if change < -tolerance:
+                regressions.append((key, metric, old[metric], result[metric]))
+    return regressions, lines
+
+
+def save(report, path):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
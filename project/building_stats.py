@@ -1,9 +1,10 @@
 # frequency is no of times per second
 BUILDING_DATA = {
     'castle': {'health': 100, 'income': 2, 'cost': 0},
-    'tower': {'health': 60, 'cost': 10, 'damage': 5, 'fire_rate': 8, 'range': 0.035},  # 0.02 is roughly one tile
-    'sniper_tower': {'health': 60, 'cost': 10, 'damage': 10, 'fire_rate': 1, 'range': 0.15},
-    'magic_tower': {'health': 60, 'cost': 10, 'damage': 30, 'fire_rate': 2, 'range': 0.025},
+    # targeting is one of the policies from components.targeting (nearest, lowest_hp, furthest)
+    'tower': {'health': 60, 'cost': 10, 'damage': 5, 'fire_rate': 8, 'range': 0.035, 'targeting': 'nearest'},  # 0.02 is roughly one tile
+    'sniper_tower': {'health': 60, 'cost': 10, 'damage': 10, 'fire_rate': 1, 'range': 0.15, 'targeting': 'nearest'},
+    'magic_tower': {'health': 60, 'cost': 10, 'damage': 30, 'fire_rate': 2, 'range': 0.025, 'targeting': 'nearest'},
 
     'barracks': {'health': 40, 'cost': 10},
     'swords_barracks': {'health': 40, 'cost': 10},
@@ -1,5 +1,6 @@
+from .spatial import SpatialGroup
 from .bullet import Bullet
-from .path import Path, PathBuilder
+from .path import Path, PathBuilder, PathGroup, PathLayer
 from .soldier import Soldier
 from .tile import Tile
 from .player import Player
@@ -1,11 +1,12 @@
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 
 import pygame as pg
 from project import config
 from collections import OrderedDict
 from project.networking import Packable
 from project.dataclasses import MapConfig
-from project.components import Tile, Player, Path, Soldier
+from project.profiling import profiler
+from project.components import Tile, Player, Path, PathGroup, PathLayer, Soldier, SpatialGroup, soldier_engine
 
 
 class Board(Packable):
@@ -13,12 +14,24 @@ class Board(Packable):
     def __init__(self, game=None):
         self.tile_group = pg.sprite.Group()
         self.building_group = pg.sprite.Group()
-        self.unit_group = pg.sprite.Group()
-        self.path_group = pg.sprite.Group()
+        self.soldier_engine = None
+        if config.USE_SOLDIER_ENGINE and soldier_engine.is_available():
+            self.soldier_engine = soldier_engine.SoldierEngine(self)
+            self.unit_group = self.soldier_engine.group
+        else:
+            self.unit_group = SpatialGroup(config.TILE_SIZE)  # allows the towers to find the soldiers in range quickly
+        self.path_group = PathGroup()  # indexed by the path ids
+        self.path_layer = PathLayer(self.path_group)  # all the paths are drawn on it
         self.bullet_group = pg.sprite.Group()
         self.tiles: Dict[Tuple[int, int], Tile] = OrderedDict()
+        self.tile_list: List[Tile] = []  # the tiles by their index
         self.board_size = None
+        self.tick = 0  # number of updates since the board was initialized. The simulation doesn't use the wall time
+        self.next_soldier_id = 0
         self.game = game
+        self.draw_signatures = {}  # Tile -> its last drawn signature, see collect_dirty_rects
+        self.is_replica = False  # the board mirrors the host's one, the soldiers come only with the states
+        self.correction_group = pg.sprite.Group()  # soldiers drawn off their position after a state, see unpack
         self.settings: Optional[MapConfig] = None
 
     def _find_neighbours(self, tile_pos):
@@ -32,10 +45,7 @@ class Board(Packable):
         return results
 
     def get_path_by_id(self, path_id):
-        for path in self.path_group.sprites():
-            if path.path_id == path_id:
-                return path
-        return None
+        return self.path_group.by_id.get(path_id)
 
     def initialize(self, settings: MapConfig, tile_size=config.TILE_SIZE):
         self.settings = settings
@@ -63,6 +73,7 @@ class Board(Packable):
         for pos, tile in self.tiles.items():
             tile.set_neighbours(self._find_neighbours(pos))
         self.tile_group.add(*self.tiles.values())
+        self.tile_list = list(self.tiles.values())
 
         for tile in castle_tiles:
             self.build_on_tile(tile, 'castle')
@@ -70,7 +81,7 @@ class Board(Packable):
         return players
 
     def get_tile_by_index(self, tile_index):
-        return list(self.tiles.values())[tile_index]
+        return self.tile_list[tile_index]
 
     def create_player(self, players, player_no, start_tile):
         """ Creates a new player, puts it in the players list and returns the newly created element """
@@ -90,40 +101,94 @@ class Board(Packable):
         tile.building = new_building
         self.building_group.add(new_building)
 
+    def create_soldier(self, unit_name):
+        """ Creates a soldier matching the way the board simulates them """
+        if self.soldier_engine:
+            return self.soldier_engine.create_soldier(unit_name)
+        return Soldier(unit_name)
+
     def add_unit(self, unit):
+        if unit.soldier_id is None:
+            unit.soldier_id = self.next_soldier_id
+            self.next_soldier_id += 1
         self.unit_group.add(unit)
 
     def add_bullet(self, bullet):
         self.bullet_group.add(bullet)
 
-    def update(self, now):
-        self.tile_group.update()
-        self.unit_group.update(now)
-        self.bullet_group.update()
-        for building in self.building_group.sprites():
-            building.update(now)
+    def update(self):
+        """ Advances the simulation by one tick. Identical commands at identical ticks give identical results """
+        self.tick += 1
+        with profiler.section('update.tiles'):
+            self.tile_group.update()
+        with profiler.section('update.units'):
+            if self.soldier_engine:
+                self.soldier_engine.step(self.tick)
+            else:
+                self.unit_group.update(self.tick)
+            for unit in self.correction_group.sprites():
+                if not unit.decay_draw_offset():
+                    self.correction_group.remove(unit)
+        with profiler.section('update.bullets'):
+            self.bullet_group.update()
+        with profiler.section('update.buildings'):
+            for building in self.building_group.sprites():
+                building.update(self.tick)
 
     def clear(self):
         self.tiles = {}
+        self.tile_list = []
+        self.tick = 0
+        self.next_soldier_id = 0
+        self.draw_signatures = {}
         self.tile_group.empty()
         self.building_group.empty()
         self.path_group.empty()
+        self.path_layer.clear()
         self.unit_group.empty()
+        self.correction_group.empty()
         self.bullet_group.empty()
 
     def draw(self, surface, interpolate, draw_health=True):
-        self.tile_group.draw(surface)
-        self.path_group.draw(surface)
-
-        self.building_group.draw(surface)
-        self.unit_group.draw(surface)
-        self.bullet_group.draw(surface)
-
+        self.draw_static(surface, draw_health)
+        self.draw_dynamic(surface, interpolate, draw_health)
+
+    def draw_static(self, surface, draw_health=True):
+        """ Draws the tiles, the paths and the buildings. They change rarely, see collect_dirty_rects """
+        with profiler.section('draw.tiles'):
+            self.tile_group.draw(surface)
+        with profiler.section('draw.paths'):
+            self.path_layer.draw(surface)
+        with profiler.section('draw.buildings'):
+            self.building_group.draw(surface)
+            if draw_health:
+                for building in self.building_group.sprites():
+                    building.draw_health(surface)
+
+    def draw_dynamic(self, surface, interpolate, draw_health=True):
+        """ Draws the soldiers and the bullets. Returns the list of rects drawn on """
+        with profiler.section('draw.units'):
+            rects = surface.blits([(unit.image, unit.get_draw_rect()) for unit in self.unit_group.sprites()])
+        with profiler.section('draw.bullets'):
+            rects += surface.blits([(bullet.image, bullet.rect) for bullet in self.bullet_group.sprites()])
         if draw_health:
-            for unit in self.unit_group.sprites():
-                unit.draw_health(surface)
-            for building in self.building_group.sprites():
-                building.draw_health(surface)
+            with profiler.section('draw.health'):
+                for unit in self.unit_group.sprites():
+                    rects += unit.draw_health(surface)
+        return rects
+
+    def collect_dirty_rects(self):
+        """
+        Returns the rects of the static parts of the board (see draw_static) which have changed since the last call.
+        A tile's rect covers the tile, its building and the building's health bar
+        """
+        rects = self.path_layer.pop_dirty_rects()
+        for tile in self.tiles.values():
+            signature = tile.get_draw_signature()
+            if self.draw_signatures.get(tile) != signature:
+                self.draw_signatures[tile] = signature
+                rects.append(tile.rect)
+        return rects
 
     def pack(self):
         return {
@@ -133,23 +198,46 @@ class Board(Packable):
         }
 
     def unpack(self, data):
-        # tiles
-        for i, tile in enumerate(self.tiles.values()):
-            tile.unpack(data['tiles'][i])
-
-        # paths
-        self.path_group.empty()
+        """ Reconciles the board with the packed one. The paths and the soldiers are matched by their ids """
+        # paths go first, the barracks on the tiles refer to them
+        paths = self.path_group.by_id.copy()
         for path_data in data['paths']:
+            path = paths.pop(path_data['path_id'], None)
             owner = self.game.players[path_data['owner_id']]
-            path = Path(self.get_tile_by_index(path_data['tile_indices'][0]), owner)
-            for i in range(1, len(path_data['tile_indices'])):  # skips the first tile
-                path.add_tile(self.get_tile_by_index(path_data['tile_indices'][i]))
+            if path is not None and path.owner is not owner:
+                path.destroy()
+                path = None
+            if path is None:
+                path = Path(self.get_tile_by_index(path_data['path_id']), owner)
             path.unpack(path_data)
+        for path in paths.values():
+            path.destroy()
 
-        # soldiers
-        self.unit_group.empty()
+        # tiles
+        for tile, tile_data in zip(self.tile_list, data['tiles']):
+            tile.unpack(tile_data)
+
+        # soldiers. The local simulation has kept moving them since the last state, the ones it has mispredicted
+        # are drawn where they were and glide to the received position instead of jumping there
+        soldiers = {unit.soldier_id: unit for unit in self.unit_group.sprites()}
         for soldier_data in data['soldiers']:
-            soldier = Soldier(soldier_data['name'])
-            soldier.release(self.get_path_by_id(soldier_data['path_id']))
-            soldier.unpack(soldier_data)
-            self.unit_group.add(soldier)
+            path = self.get_path_by_id(soldier_data['path_id'])
+            soldier = soldiers.pop(soldier_data['id'], None)
+            if soldier is not None and soldier.path is path:
+                drawn_at = soldier.get_draw_rect().center
+                soldier.unpack(soldier_data)
+                if soldier.set_draw_offset(drawn_at):
+                    self.correction_group.add(soldier)
+                else:
+                    self.correction_group.remove(soldier)
+            else:
+                if soldier is not None:
+                    soldier.kill()
+                soldier = self.create_soldier(soldier_data['name'])
+                soldier.release(path)
+                soldier.unpack(soldier_data)
+                self.unit_group.add(soldier)
+        for soldier in soldiers.values():
+            soldier.kill()
+        if not self.soldier_engine:
+            self.unit_group.refresh()  # the updated soldiers may have left their cells
@@ -1,6 +1,6 @@
 import pygame as pg
-from project.components.soldier import Soldier, dist_sq
-from project.tools import pos_to_relative, get_health_surface
+from project.components.targeting import TARGETING_POLICIES
+from project.tools import get_health_surface, get_sprite, seconds_to_ticks
 from project.networking import Packable
 from project.components import Bullet
 from project.building_stats import *
@@ -19,31 +19,28 @@ class Building(pg.sprite.Sprite, Packable):
         self.owner = tile.owner
         if not self.owner:
             raise ValueError('Building with no owner created: ', self.name)
-        self.last_passive_time = 0  # when was the last time the passive was executed
-        self.delay = 1  # time between adjacent passive() calls in seconds
+        self.last_passive_tick = 0  # when was the last time the passive was executed
+        self.delay = seconds_to_ticks(1)  # ticks between adjacent passive() calls
         self.tile = tile
 
-        self.image = config.gfx['buildings'][building_name]
-        self.image = pg.transform.scale(self.image, (config.TILE_SPRITE_SIZE,) * 2)
+        size = (config.TILE_SPRITE_SIZE,) * 2
+        self.building_image = get_sprite('buildings', building_name, size)
+        self.image = self.building_image
         self.rect = self.image.get_rect(center=tile.rect.center)
         self.damage_timer = 0
-        self.damage_image = config.gfx['utils']['boom']
-        self.damage_image = pg.transform.scale(self.damage_image, (config.TILE_SPRITE_SIZE,) * 2)
+        self.damage_image = get_sprite('utils', 'boom', size)
         self.damage_rect = self.rect
-        self.building_sprites = []
-        self.building_sprites.append(config.gfx['utils']['building_anim'])
-        self.building_sprites.append(config.gfx['utils']['building_anim_2'])
-        for i in range(len(self.building_sprites)):
-            self.building_sprites[i] = pg.transform.scale(self.building_sprites[i], (config.TILE_SPRITE_SIZE,) * 2)
+        self.building_sprites = [get_sprite('utils', 'building_anim', size),
+                                 get_sprite('utils', 'building_anim_2', size)]
         self.anim = Animation(self.building_sprites, fps=7)
-        self.building_image = config.gfx['buildings'][building_name]
-        self.building_image = pg.transform.scale(self.building_image, (config.TILE_SPRITE_SIZE,) * 2)
 
-    def update(self, now):
-        """ Called every frame. Handles the building animation"""
+    def update(self, tick):
+        """ Called every tick. Handles the building animation"""
+        if self.damage_timer > 0:
+            self.damage_timer -= 1
         if not self.is_built:
             if self.health < self.max_health:
-                self.image = self.anim.get_next_frame(now)
+                self.image = self.anim.get_next_frame(tick)
                 self.health += BUILDING_SPEED
 
             else:
@@ -51,8 +48,8 @@ class Building(pg.sprite.Sprite, Packable):
                 self.image = self.building_image
                 self.is_built = True
         # passive is not executed while the building is being built
-        elif self.last_passive_time <= now - self.delay * 1000:
-            self.last_passive_time = now
+        elif self.last_passive_tick <= tick - self.delay:
+            self.last_passive_tick = tick
             self.passive()
 
     def get_upgrade_types(self):
@@ -62,7 +59,7 @@ class Building(pg.sprite.Sprite, Packable):
         return UPGRADE_TYPES.get(self.name, [])
 
     def passive(self):
-        # Called every self.delay seconds
+        # Called every self.delay ticks
         pass
 
     def active(self):
@@ -98,12 +95,18 @@ class Building(pg.sprite.Sprite, Packable):
         if self.health <= 0:
             self.destroy()
 
+    def get_health_image(self):
+        health_ratio = self.health / self.max_health
+        return get_health_surface(health_ratio, config.TILE_SPRITE_SIZE, config.TILE_SPRITE_SIZE*0.12)
+
+    def get_draw_signature(self):
+        """ Changes whenever the building looks different. Everything it draws lies within its tile's rect """
+        return self.image, self.get_health_image(), self.damage_timer > 0
+
     def draw_health(self, surface):
         if self.damage_timer > 0:
             surface.blit(self.damage_image, self.damage_rect)
-            self.damage_timer -= 1
-        health_ratio = self.health / self.max_health
-        health_img = get_health_surface(health_ratio, config.TILE_SPRITE_SIZE, config.TILE_SPRITE_SIZE*0.12)
+        health_img = self.get_health_image()
         health_rect = health_img.get_rect(centerx=self.tile.rect.centerx, top=self.tile.rect.top+5)
         surface.blit(health_img, health_rect)
 
@@ -142,14 +145,17 @@ class Tower(Building):
         self.fire_rate = BUILDING_DATA[self.name]['fire_rate']
         self.damage = BUILDING_DATA[self.name]['damage']
         self.range = BUILDING_DATA[self.name]['range']
-        self.bullet_image = config.gfx['utils'][self.name.split('_')[0]+'_bullet']
+        self.targeting = TARGETING_POLICIES[BUILDING_DATA[self.name]['targeting']]
+        self.bullet_image = get_sprite('utils', self.name.split('_')[0]+'_bullet', (config.BULLET_SIZE,) * 2)
+
+    def get_enemies_in_range(self):
+        return self.tile.board.unit_group.sprites_in_range(self.rect.center, self.range, exclude_owner=self.owner)
 
     def passive(self):
-        for soldier in self.tile.board.unit_group.sprites():
-            if soldier.owner != self.owner and dist_sq(pos_to_relative(soldier.rect.center), pos_to_relative(self.rect.center)) < self.range:
-                self.tile.board.add_bullet(Bullet(self.bullet_image, self.rect.center, soldier, self.damage))
-                self.delay = 1/self.fire_rate
-                break
+        target = self.targeting(self, self.get_enemies_in_range())
+        if target is not None:
+            self.tile.board.add_bullet(Bullet(self.bullet_image, self.rect.center, target, self.damage))
+            self.delay = seconds_to_ticks(1/self.fire_rate)
 
 
 class SniperTower(Tower):
@@ -168,7 +174,7 @@ class Barracks(Building):
         self.path = None
         self.tile = tile
         self.soldier_queue = []
-        self.delay = 2
+        self.delay = seconds_to_ticks(2)
         self.soldier_name = self.name.split('_')[0]
 
     def set_path(self, path):
@@ -176,7 +182,7 @@ class Barracks(Building):
 
     def try_to_train_soldiers(self):
         if len(self.soldier_queue) < 3:
-            soldier = Soldier(self.soldier_name)
+            soldier = self.tile.board.create_soldier(self.soldier_name)
             self.soldier_queue.append(soldier)
 
     def try_to_release_soldier(self):
@@ -187,6 +193,8 @@ class Barracks(Building):
             # print(f"Releasing a players {soldier.tile.owner.id} soldier")
 
     def passive(self):
+        if self.tile.board.is_replica:  # the host trains the soldiers, the client gets them with the state
+            return
         self.try_to_train_soldiers()
         self.try_to_release_soldier()
 
@@ -215,8 +223,7 @@ class Barracks(Building):
 
     def unpack(self, data):
         super().unpack(data)
-        if data['path_id']:
-            self.path = self.tile.board.get_path_by_id(data['path_id'])
+        self.path = self.tile.board.get_path_by_id(data['path_id']) if data['path_id'] is not None else None
 
 
 class SwordBarracks(Barracks):
@@ -235,7 +242,7 @@ class Market(Building):
         self.income = BUILDING_DATA[self.name]['income']
         self.frequency = BUILDING_DATA[self.name]['frequency']
         self.owner.change_income(self.income / self.frequency)
-        self.delay = self.delay * self.frequency
+        self.delay = seconds_to_ticks(self.frequency)
 
     def passive(self):
         self.owner.add_gold(self.income)
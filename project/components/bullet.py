@@ -1,13 +1,12 @@
 import pygame as pg
 import math
-from project import config
 from project.tools import dist_sq
 
 
 class Bullet(pg.sprite.Sprite):
     def __init__(self, image, start_pos, target, damage):
         pg.sprite.Sprite.__init__(self)
-        self.image = pg.transform.scale(image, (config.BULLET_SIZE,)*2)
+        self.image = image  # already scaled to config.BULLET_SIZE, see tools.get_sprite
         self.target = target
         self.speed = 5
         self.target_rect = self.target.rect
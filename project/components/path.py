@@ -4,29 +4,95 @@ from project import config
 from project.networking import Packable
 
 
-class Path(pg.sprite.Sprite, Packable):
-    def __init__(self, start_tile, player):
-        self.image = pg.Surface(config.SCREEN_SIZE)
+class PathLayer:
+    """
+    Screen sized surface shared by all the paths of a board.
+    When a path grows or shrinks only the changed segment is drawn or erased.
+    """
+    LINE_WIDTH = 5
+
+    def __init__(self, paths, size=config.SCREEN_SIZE):
+        self.paths = paths  # group of the paths drawn on this layer
+        self.image = pg.Surface(size)
         self.image.set_colorkey(config.COLORKEY)
         self.image.fill(config.COLORKEY)
         self.rect = self.image.get_rect()
+        self.dirty_rects = []  # areas changed since the last pop_dirty_rects()
+
+    @classmethod
+    def get_segment_rect(cls, segment):
+        (x1, y1), (x2, y2) = segment
+        rect = pg.Rect(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+        return rect.inflate(cls.LINE_WIDTH * 2, cls.LINE_WIDTH * 2)
+
+    def draw_segment(self, segment, color):
+        pg.draw.line(self.image, color, *segment, width=self.LINE_WIDTH)
+        self.dirty_rects.append(self.get_segment_rect(segment))
+
+    def erase_segment(self, segment):
+        """ Clears the area of the segment and redraws the remaining segments crossing it """
+        area = self.get_segment_rect(segment)
+        self.image.fill(config.COLORKEY, area)
+        self.dirty_rects.append(area)
+        for path in self.paths.sprites():
+            for other in path.segments:
+                if area.colliderect(self.get_segment_rect(other)):
+                    self.draw_segment(other, path.color)
+
+    def clear(self):
+        self.image.fill(config.COLORKEY)
+        self.dirty_rects = [self.rect.copy()]
+
+    def pop_dirty_rects(self):
+        rects, self.dirty_rects = self.dirty_rects, []
+        return rects
+
+    def draw(self, surface):
+        surface.blit(self.image, self.rect)
+
+
+class PathGroup(pg.sprite.Group):
+    """ Sprite group which also indexes its paths by their path_id. Used as the board's path_group """
+    def __init__(self, *sprites):
+        self.by_id = {}
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, *args):
+        super().add_internal(sprite, *args)
+        self.by_id[sprite.path_id] = sprite
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if self.by_id.get(sprite.path_id) is sprite:
+            del self.by_id[sprite.path_id]
+
+
+class Path(pg.sprite.Sprite, Packable):
+    """ Path the soldiers walk along. Stored as a list of segments drawn on the board's PathLayer """
+    def __init__(self, start_tile, player):
+        self.path_id = start_tile.index  # no two paths can start at the same tile. Used to unpack units online
         super().__init__(start_tile.board.path_group)
+        self.path_layer = start_tile.board.path_layer
         self.tiles = []
-        self.path_id = start_tile.index  # no two paths can start at the same tile. Used to unpack units online
+        self.segments = []  # [(start center, end center)] between consecutive tiles
         self.owner = player
         self.is_destroyed = False
         self.color = tuple([int(0.8 * x) for x in self.owner.color])
         self.add_tile(start_tile)
 
     def add_tile(self, tile):
+        if self.tiles:
+            segment = (self.tiles[-1].rect.center, tile.rect.center)
+            self.segments.append(segment)
+            self.path_layer.draw_segment(segment, self.color)
         self.tiles.append(tile)
         tile.paths[self.owner.id] = self
-        self.update_image()
 
     def pop_tile(self):
         tile = self.tiles.pop()
         tile.paths[self.owner.id] = None
-        self.update_image()
+        if self.segments:
+            self.path_layer.erase_segment(self.segments.pop())
 
     def destroy(self):
         self.is_destroyed = True
@@ -35,13 +101,9 @@ class Path(pg.sprite.Sprite, Packable):
             if self.tiles[0].building:
                 self.tiles[0].building.set_path(None)
         self.kill()
-
-    def update_image(self):
-        self.image.fill(config.COLORKEY)
-        for i in range(len(self.tiles)-1):
-            src = self.tiles[i]
-            to = self.tiles[i+1]
-            pg.draw.line(self.image, self.color, src.rect.center, to.rect.center, width=5)
+        segments, self.segments = self.segments, []
+        for segment in segments:
+            self.path_layer.erase_segment(segment)
 
     def pack(self):
         return {
@@ -51,7 +113,16 @@ class Path(pg.sprite.Sprite, Packable):
         }
 
     def unpack(self, data):
-        self.path_id = data['path_id']
+        """ Keeps the tiles shared with the packed path and replaces the rest. Only the changed segments are redrawn """
+        board = self.tiles[0].board
+        indices = data['tile_indices']
+        common = 1  # the start tile is the path's id, it never changes
+        while common < min(len(self.tiles), len(indices)) and self.tiles[common].index == indices[common]:
+            common += 1
+        while len(self.tiles) > common:
+            self.pop_tile()
+        for index in indices[common:]:
+            self.add_tile(board.get_tile_by_index(index))
 
 
 class PathBuilder:
@@ -191,9 +191,10 @@ class Player(Packable):
         surface.blit(self.marker.image, self.marker.rect)
 
     def draw_menu(self, surface):
-        """Draws a choice menu if in build or upgrade mode"""
+        """Draws a choice menu if in build or upgrade mode. Returns the rect drawn on or None"""
         if self.in_build_mode or self.in_upgrade_mode:
-            surface.blit(*self.menu_image)
+            return surface.blit(*self.menu_image)
+        return None
 
 
 class PlayerMarker(pg.sprite.Sprite):
@@ -1,7 +1,7 @@
 import math
 import pygame as pg
 from project import config
-from project.tools import dist_sq, get_health_surface, pos_to_relative, pos_to_absolute
+from project.tools import dist_sq, get_health_surface, get_sprite, pos_to_relative, pos_to_absolute
 from project.building_stats import SOLDIER_STATS, SOLDIER_ANIM_FPS
 from project.tools import Animation
 from project.networking import Packable
@@ -13,6 +13,7 @@ class Soldier(pg.sprite.Sprite, Packable):
         pg.sprite.Sprite.__init__(self)
         stats = SOLDIER_STATS[unit_name]
         self.name = unit_name
+        self.soldier_id = None  # unique on the board, assigned when the soldier is added to it
         self.max_health = stats['health']
         self.health = self.max_health
         self.damage = stats['attack']
@@ -23,17 +24,15 @@ class Soldier(pg.sprite.Sprite, Packable):
         self.image = None
 
         self.flipped = False
-        self.sprites = []
-        self.sprites.append(config.gfx['units'][self.name + '_soldier'])
-        self.sprites.append(config.gfx['units'][self.name + '_soldier_2'])
-        for i in range(len(self.sprites)):
-            self.sprites[i] = pg.transform.scale(self.sprites[i], (config.UNIT_SIZE,) * 2)
+        frame_names = [self.name + '_soldier', self.name + '_soldier_2']
+        self.sprites = [get_sprite('units', frame, (config.UNIT_SIZE,) * 2) for frame in frame_names]
+        self.flipped_sprites = [get_sprite('units', frame, (config.UNIT_SIZE,) * 2, flip=True) for frame in frame_names]
         self.speed = 1
         self.path_tile_index = 1
         self.damage_timer = 0
-        self.damage_image = config.gfx['utils']['boom']
-        self.damage_image = pg.transform.scale(self.damage_image, (config.TILE_SPRITE_SIZE,) * 2)
+        self.damage_image = get_sprite('utils', 'boom', (config.TILE_SPRITE_SIZE,) * 2)
         self.damage_rect = None
+        self.draw_offset = None  # (dx, dy) from the simulated position to the drawn one, shrinks every tick
         self.is_dead = False
         self.dying_timer = 10
         self.anim = Animation(self.sprites, SOLDIER_ANIM_FPS)
@@ -57,22 +56,29 @@ class Soldier(pg.sprite.Sprite, Packable):
         dx, dy = (to[0] - src[0]) / hypot * scale, (to[1] - src[1]) / hypot * scale
         return dx, dy
 
+    def get_progress(self):
+        """ How far along the path the soldier is. The bigger the further. Used for targeting """
+        try:
+            remaining = dist_sq(self.rect.center, self.path.tiles[self.path_tile_index].rect.center)
+        except IndexError:
+            remaining = 0
+        return self.path_tile_index, -remaining
+
     def try_to_attack(self):
         if self.tile.building is not None and self.tile.owner != self.owner:
             self.attack(self.tile.building)
 
-    def update(self, now):
+    def update(self, tick):
         if self.is_dead:
             self.die()
             return
 
-        self.image = self.anim.get_next_frame(now)
+        self.anim.get_next_frame(tick)
         if self.move_vector[0] < 0:
             self.flipped = True
         if self.move_vector[0] > 0:
             self.flipped = False
-        if self.flipped:
-            self.image = pg.transform.flip(self.image, True, False)
+        self.image = (self.flipped_sprites if self.flipped else self.sprites)[self.anim.frame]
 
         if self.path.is_destroyed:  # tha path under the soldier has disappeared
             self.is_dead = True
@@ -111,17 +117,44 @@ class Soldier(pg.sprite.Sprite, Packable):
         else:
             self.kill()
 
+    def set_draw_offset(self, drawn_center):
+        """
+        Keeps drawing the soldier at drawn_center after its position has been corrected by a received state.
+        Returns False if the correction is too small or too big to be smoothed
+        """
+        dx, dy = drawn_center[0] - self.rect.centerx, drawn_center[1] - self.rect.centery
+        smoothed = 1 <= dx * dx + dy * dy <= config.SOLDIER_SNAP_DISTANCE ** 2
+        self.draw_offset = (dx, dy) if smoothed else None
+        return smoothed
+
+    def decay_draw_offset(self):
+        """ Moves the drawn position closer to the simulated one. Returns False once they are the same """
+        decay = config.SOLDIER_CORRECTION_DECAY
+        dx, dy = self.draw_offset[0] * decay, self.draw_offset[1] * decay
+        self.draw_offset = (dx, dy) if dx * dx + dy * dy >= 1 else None
+        return self.draw_offset is not None
+
+    def get_draw_rect(self):
+        if self.draw_offset is None:
+            return self.rect
+        return self.rect.move(round(self.draw_offset[0]), round(self.draw_offset[1]))
+
     def draw_health(self, surface):
+        """ Returns the rects drawn on """
+        rects = []
+        rect = self.get_draw_rect()
         if self.damage_timer > 0:
-            surface.blit(self.damage_image, self.damage_image.get_rect(center=self.rect.center))
+            rects.append(surface.blit(self.damage_image, self.damage_image.get_rect(center=rect.center)))
             self.damage_timer -= 1
         health_ratio = max(0, self.health / self.max_health)
         health_img = get_health_surface(health_ratio, config.TILE_SPRITE_SIZE*0.6, config.TILE_SPRITE_SIZE * 0.10)
-        health_rect = health_img.get_rect(centerx=self.rect.centerx, top=self.rect.top - 4)
-        surface.blit(health_img, health_rect)
+        health_rect = health_img.get_rect(centerx=rect.centerx, top=rect.top - 4)
+        rects.append(surface.blit(health_img, health_rect))
+        return rects
 
     def pack(self):
         return {
+            'id': self.soldier_id,
             'name': self.name,
             'pos': pos_to_relative(self.rect.center),
             'hp': self.health,
@@ -132,6 +165,7 @@ class Soldier(pg.sprite.Sprite, Packable):
         }
 
     def unpack(self, data):
+        self.soldier_id = data['id']
         self.path_tile_index = data['curr_path_index']
         self.rect.center = pos_to_absolute(data['pos'])
         self.move_vector = data['move_vector']
@@ -0,0 +1,283 @@
+"""
+Optional vectorized soldier simulation (enabled with config.USE_SOLDIER_ENGINE, requires numpy).
+The per soldier state lives in numpy arrays (struct of arrays) and all the soldiers are advanced with one
+vectorized step per tick. Soldier sprites attached to the engine are thin views over these arrays used for drawing,
+packing and by the towers. Arrivals, attacks and deaths are collected during the step and handled in batches.
+"""
+import pygame as pg
+from project import config
+from project.tools import pos_to_relative, TICKS_PER_SECOND
+from project.building_stats import SOLDIER_ANIM_FPS
+from project.components.soldier import Soldier
+
+try:
+    import numpy as np
+except ImportError:  # the engine is optional, Board falls back to the per sprite update
+    np = None
+
+
+def is_available():
+    return np is not None
+
+
+class _EngineField:
+    """ Soldier attribute kept in the engine's array while the soldier is attached to the engine """
+    def __init__(self, array_name):
+        self.array_name = array_name
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, soldier, owner=None):
+        if soldier is None:
+            return self
+        if soldier.slot is None:
+            return soldier.__dict__[self.name]
+        return getattr(soldier.engine, self.array_name)[soldier.slot].item()
+
+    def __set__(self, soldier, value):
+        if soldier.slot is None:
+            soldier.__dict__[self.name] = value
+        else:
+            getattr(soldier.engine, self.array_name)[soldier.slot] = value
+
+
+class _EngineVector(_EngineField):
+    """ Same as _EngineField but for the 2d vectors. None is stored as a zero vector """
+    def __get__(self, soldier, owner=None):
+        if soldier is None or soldier.slot is None:
+            return super().__get__(soldier, owner)
+        return tuple(getattr(soldier.engine, self.array_name)[soldier.slot].tolist())
+
+    def __set__(self, soldier, value):
+        super().__set__(soldier, (0, 0) if value is None and soldier.slot is not None else value)
+
+
+class EngineSoldier(Soldier):
+    """ Soldier whose simulation state is owned by the SoldierEngine once it is added to the board """
+    health = _EngineField('health')
+    is_dead = _EngineField('dead')
+    path_tile_index = _EngineField('path_index')
+    flipped = _EngineField('flipped')
+    damage_timer = _EngineField('damage_timer')
+    dying_timer = _EngineField('dying_timer')
+    move_vector = _EngineVector('move')
+
+    def __init__(self, unit_name, engine):
+        self.engine = engine
+        self.slot = None  # index in the engine's arrays, None if not attached
+        super().__init__(unit_name)
+
+    @property
+    def image(self):
+        """ The animation frame is shared by all the soldiers and is kept by the engine """
+        return (self.flipped_sprites if self.flipped else self.sprites)[self.engine.frame]
+
+    @image.setter
+    def image(self, value):
+        pass  # derived from the engine's animation clock
+
+    def update(self, tick):
+        pass  # advanced by SoldierEngine.step
+
+    def unpack(self, data):
+        super().unpack(data)
+        if self.slot is not None:
+            self.engine.load(self)
+
+
+class EngineGroup(pg.sprite.Group):
+    """ Sprite group attaching its soldiers to the engine. Used as the board's unit_group """
+    def __init__(self, engine):
+        self.engine = engine
+        super().__init__()
+
+    def add_internal(self, sprite, *args):
+        super().add_internal(sprite, *args)
+        self.engine.attach(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.engine.detach(sprite)
+
+    def sprites_in_range(self, center, rel_range, exclude_owner=None):
+        """ Vectorized version of SpatialGroup.sprites_in_range. Dead soldiers are skipped """
+        engine, n = self.engine, self.engine.size
+        rel = engine.pos[:n] / (config.WIDTH, config.HEIGHT) - pos_to_relative(center)
+        mask = ((rel * rel).sum(axis=1) < rel_range) & ~engine.dead[:n]
+        if exclude_owner is not None:
+            mask &= engine.owner[:n] != exclude_owner.id
+        return [engine.soldiers[i] for i in np.flatnonzero(mask)]
+
+
+class SoldierEngine:
+    ARRAYS = {  # name: (shape after the capacity, dtype)
+        'pos': ((2,), float),
+        'target': ((2,), float),
+        'move': ((2,), float),
+        'health': ((), float),
+        'path_index': ((), np.int32 if np else int),
+        'path_ref': ((), np.int32 if np else int),
+        'owner': ((), np.int8 if np else int),
+        'dead': ((), bool),
+        'flipped': ((), bool),
+        'damage_timer': ((), np.int32 if np else int),
+        'dying_timer': ((), np.int32 if np else int),
+    }
+
+    def __init__(self, board, capacity=64):
+        if np is None:
+            raise RuntimeError('The soldier engine requires numpy')
+        self.board = board
+        self.size = 0  # slots [0, size) are in use
+        self.capacity = capacity
+        for name, (shape, dtype) in self.ARRAYS.items():
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+        self.soldiers = []  # slot -> EngineSoldier
+        self.paths = []  # path_ref -> Path, None if free
+        self.path_refs = {}  # Path -> [path_ref, soldier count]
+        self.frame = 0  # current animation frame of all the soldiers
+        self.group = EngineGroup(self)
+
+    def create_soldier(self, unit_name):
+        return EngineSoldier(unit_name, self)
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, (shape, dtype) in self.ARRAYS.items():
+            array = np.zeros((self.capacity,) + shape, dtype=dtype)
+            array[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, array)
+
+    def _ref_path(self, path):
+        entry = self.path_refs.get(path)
+        if entry is None:
+            ref = self.paths.index(None) if None in self.paths else len(self.paths)
+            if ref == len(self.paths):
+                self.paths.append(path)
+            else:
+                self.paths[ref] = path
+            entry = self.path_refs[path] = [ref, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _unref_path(self, path):
+        entry = self.path_refs[path]
+        entry[1] -= 1
+        if entry[1] == 0:
+            self.paths[entry[0]] = None
+            del self.path_refs[path]
+
+    def attach(self, soldier):
+        """ Moves the soldier's state into the arrays """
+        if self.size == self.capacity:
+            self._grow()
+        slot = self.size
+        values = {name: soldier.__dict__[name] for name in
+                  ('health', 'is_dead', 'path_tile_index', 'flipped', 'damage_timer', 'dying_timer', 'move_vector')}
+        self.size += 1
+        self.soldiers.append(soldier)
+        soldier.slot = slot
+        for name, value in values.items():
+            setattr(soldier, name, value)
+        self.path_ref[slot] = self._ref_path(soldier.path)
+        self.owner[slot] = soldier.owner.id
+        self.load(soldier)
+
+    def load(self, soldier):
+        """ Reads the position dependant state of the soldier's sprite """
+        slot = soldier.slot
+        self.pos[slot] = soldier.rect.center
+        try:
+            self.target[slot] = soldier.path.tiles[self.path_index[slot]].rect.center
+        except IndexError:  # the path has changed, unit has to die
+            self.dead[slot] = True
+
+    def detach(self, soldier):
+        """ Moves the soldier's state back to the sprite and frees its slot """
+        slot = soldier.slot
+        values = {name: getattr(soldier, name) for name in
+                  ('health', 'is_dead', 'path_tile_index', 'flipped', 'damage_timer', 'dying_timer', 'move_vector')}
+        soldier.slot = None
+        for name, value in values.items():
+            setattr(soldier, name, value)
+        self._unref_path(soldier.path)
+
+        last = self.size - 1
+        if slot != last:  # move the last soldier into the hole
+            for name in self.ARRAYS:
+                array = getattr(self, name)
+                array[slot] = array[last]
+            moved = self.soldiers[last]
+            moved.slot = slot
+            self.soldiers[slot] = moved
+        self.soldiers.pop()
+        self.size = last
+
+    def step(self, tick):
+        """ Advances all the soldiers by one tick """
+        self.frame = int(tick * SOLDIER_ANIM_FPS // TICKS_PER_SECOND) % 2
+        n = self.size
+        if n == 0:
+            return
+        dead, dying_timer = self.dead[:n], self.dying_timer[:n]
+
+        # dying soldiers show the explosion for a while before they disappear
+        dying = dead.copy()
+        expired = dying & (dying_timer == 0)
+        counting = dying & ~expired
+        self.damage_timer[:n][counting] = dying_timer[counting]
+        dying_timer[counting] -= 1
+
+        # the path under the soldier has disappeared or got shorter
+        path_gone = np.array([path is None or path.is_destroyed for path in self.paths], dtype=bool)
+        path_len = np.array([len(path.tiles) if path else 0 for path in self.paths])
+        path_ref, path_index = self.path_ref[:n], self.path_index[:n]
+        lost = ~dying & (path_gone[path_ref] | (path_index >= path_len[path_ref]))
+        dead[lost] = True
+
+        active = ~dying & ~lost
+        pos, move = self.pos[:n], self.move[:n]
+        delta = self.target[:n] - pos
+        arrived = active & ((delta * delta).sum(axis=1) < 0.001)
+        moving = active & ~arrived
+        pos[moving] += move[moving]
+        flipped = self.flipped[:n]
+        flipped[active & (move[:, 0] < 0)] = True
+        flipped[active & (move[:, 0] > 0)] = False
+
+        # sync the sprites' rects, the bullets follow them
+        moved = np.flatnonzero(moving)
+        for slot, center in zip(moved.tolist(), pos[moved].tolist()):
+            self.soldiers[slot].rect.center = center
+
+        arrivals = [self.soldiers[slot] for slot in np.flatnonzero(arrived)]
+        deaths = [self.soldiers[slot] for slot in np.flatnonzero(expired)]
+        self.handle_arrivals(arrivals)
+        for soldier in deaths:
+            soldier.kill()
+
+    def handle_arrivals(self, soldiers):
+        """ Soldiers which have reached their target tile attack it and head for the next one """
+        advancing = []
+        for soldier in soldiers:
+            soldier.try_to_attack()
+            if not soldier.alive():
+                continue
+            if soldier.path_tile_index == len(soldier.path.tiles) - 1:  # soldier disappears at the end of the path
+                soldier.kill()
+            else:
+                advancing.append(soldier)
+
+        if not advancing:
+            return
+        slots = np.array([soldier.slot for soldier in advancing])
+        self.path_index[slots] += 1
+        for soldier in advancing:
+            soldier.tile = soldier.path.tiles[soldier.path_tile_index]
+            self.target[soldier.slot] = soldier.tile.rect.center
+        delta = self.target[slots] - self.pos[slots]
+        hypot = np.sqrt((delta * delta).sum(axis=1))
+        speed = np.array([soldier.speed for soldier in advancing], dtype=float)
+        self.move[slots] = delta / np.where(hypot == 0, 1, hypot)[:, None] * speed[:, None]
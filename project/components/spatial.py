@@ -0,0 +1,79 @@
+import math
+import pygame as pg
+from project import config
+from project.tools import dist_sq, pos_to_relative
+
+
+class SpatialGroup(pg.sprite.Group):
+    """
+    Sprite group that additionally buckets its sprites into a uniform grid of cells.
+    Allows to find the sprites near a point without scanning the whole group.
+    Buckets are dicts (not sets) so the query order is deterministic.
+    """
+    def __init__(self, cell_size=config.TILE_SIZE, *sprites):
+        self.cell_size = cell_size
+        self.cells = {}  # Dict[(int, int), Dict[Sprite, None]]
+        self.sprite_cells = {}  # Dict[Sprite, (int, int)]
+        super().__init__(*sprites)
+
+    def _cell_of(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def _insert(self, sprite, cell):
+        self.sprite_cells[sprite] = cell
+        self.cells.setdefault(cell, {})[sprite] = None
+
+    def _discard(self, sprite):
+        cell = self.sprite_cells.pop(sprite, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            del bucket[sprite]
+            if not bucket:
+                del self.cells[cell]
+
+    def add_internal(self, sprite, *args):
+        super().add_internal(sprite, *args)
+        self._insert(sprite, self._cell_of(sprite.rect.center))
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self._discard(sprite)
+
+    def relocate(self, sprite):
+        """ Moves the sprite to the right bucket. Call it after the sprite's rect was moved outside of update() """
+        cell = self._cell_of(sprite.rect.center)
+        if self.sprite_cells.get(sprite) != cell:
+            self._discard(sprite)
+            self._insert(sprite, cell)
+
+    def refresh(self):
+        """ Rebuckets all the sprites which have left their cell """
+        for sprite in self.sprites():
+            self.relocate(sprite)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.refresh()
+
+    def query_box(self, center, half_width, half_height):
+        """ Yields sprites from all the cells overlapping the box. May contain sprites outside of the box """
+        min_x, min_y = self._cell_of((center[0] - half_width, center[1] - half_height))
+        max_x, max_y = self._cell_of((center[0] + half_width, center[1] + half_height))
+        for y in range(min_y, max_y + 1):
+            for x in range(min_x, max_x + 1):
+                bucket = self.cells.get((x, y))
+                if bucket:
+                    yield from list(bucket)
+
+    def sprites_in_range(self, center, rel_range, exclude_owner=None):
+        """
+        Returns the living sprites whose center lies within the range from the center.
+        :param center: absolute position
+        :param rel_range: squared distance measured in the relative coordinates (see tools.pos_to_relative)
+        :param exclude_owner: if given, sprites owned by this player are skipped
+        """
+        reach = math.sqrt(rel_range)
+        rel_center = pos_to_relative(center)
+        return [sprite for sprite in self.query_box(center, reach * config.WIDTH, reach * config.HEIGHT)
+                if not sprite.is_dead and (exclude_owner is None or sprite.owner != exclude_owner)
+                and dist_sq(pos_to_relative(sprite.rect.center), rel_center) < rel_range]
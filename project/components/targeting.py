@@ -0,0 +1,24 @@
+"""
+Tower targeting policies.
+Each policy takes the tower and the list of enemy soldiers in its range and returns the one to shoot at (or None).
+"""
+from project.tools import dist_sq
+
+
+def nearest(tower, soldiers):
+    return min(soldiers, key=lambda s: dist_sq(s.rect.center, tower.rect.center), default=None)
+
+
+def lowest_hp(tower, soldiers):
+    return min(soldiers, key=lambda s: s.health, default=None)
+
+
+def furthest_along_path(tower, soldiers):
+    return max(soldiers, key=lambda s: s.get_progress(), default=None)
+
+
+TARGETING_POLICIES = {
+    'nearest': nearest,
+    'lowest_hp': lowest_hp,
+    'furthest': furthest_along_path,
+}
@@ -51,6 +51,10 @@ class Tile(pg.sprite.Sprite, Packable):
         self.building_path = False
         self.board = board
 
+    def get_draw_signature(self):
+        """ Changes whenever the tile or its building looks different """
+        return self.owner, self.building.get_draw_signature() if self.building else None
+
     def set_neighbours(self, neighbours):
         self.neighbours = neighbours
 
@@ -13,6 +13,7 @@ class UI(pg.sprite.Sprite):
         self.player_gold: Dict[int: int] = {k: self.players[k].gold for k in self.players}
         self.player_incomes: Dict[int: int] = {k: self.players[k].income for k in self.players}
         self.info: Dict[int: Any[pg.Surface, pg.Rect]] = {k: None for k in self.players}
+        self.dirty_rects = []  # infos re-rendered since the last pop_dirty_rects()
         self.info_positions = {
             1: 'topleft',
             2: 'topright',
@@ -45,6 +46,7 @@ class UI(pg.sprite.Sprite):
             'image': info,
             'rect': info.get_rect(**kwargs)
         }
+        self.dirty_rects.append(self.info[player_no]['rect'])
 
     @staticmethod
     def show_winner(surface, winner: Player):
@@ -62,7 +64,7 @@ class UI(pg.sprite.Sprite):
         # setting the relative positions of texts on the background
         text_bg.blit(text, text.get_rect(top=text_bg_rect.top, centerx=text_bg_rect.centerx))
         text_bg.blit(subtext, subtext.get_rect(centery=text_bg_rect.centery+pad+10, centerx=text_bg_rect.centerx))
-        surface.blit(text_bg, text_bg.get_rect(center=config.SCREEN_RECT.center))
+        return surface.blit(text_bg, text_bg.get_rect(center=config.SCREEN_RECT.center))
 
     def update(self):
         for k in self.players:
@@ -72,6 +74,10 @@ class UI(pg.sprite.Sprite):
                 self.player_incomes[k] = self.players[k].income
                 self.draw_dynamic_info(k)
 
+    def pop_dirty_rects(self):
+        rects, self.dirty_rects = self.dirty_rects, []
+        return rects
+
     def draw(self, surface):
         for k in self.players:
             surface.blit(self.info[k]['image'], self.info[k]['rect'])
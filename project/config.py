@@ -2,22 +2,31 @@ import os, math
 import pygame as pg
 from . import colors, tools
 
-pg.init()  # its here to start loading everything up asap
+# Headless mode (RTS_HEADLESS=1 environment variable, has to be set before the project is imported).
+# Only the simulation can be run then: there is no display surface, no fonts, no joysticks and the graphics
+# are not decoded (see stub_gfx_from_dirs).
+HEADLESS = os.environ.get('RTS_HEADLESS', '0') not in ('', '0')
+
+if not HEADLESS:
+    pg.init()  # its here to start loading everything up asap
 
 WIDTH, HEIGHT = (int(1280 / 1.4), int(720 / 1.4))
 SCREEN_SIZE = (WIDTH, HEIGHT)
 SCREEN_RECT = pg.Rect((0, 0), SCREEN_SIZE)
-_screen = pg.display.set_mode(SCREEN_SIZE)
+_screen = pg.display.set_mode(SCREEN_SIZE) if not HEADLESS else None
 BACKGROUND_COLOR = colors.LIGHT_GRAY
 COLORKEY = (255, 0, 255)  # treated as alpha - bright purple
 
 # Display until loading finishes.
-FONT_LARGE = pg.font.SysFont("comicsansms", 110)
-FONT_BIG = pg.font.SysFont("comicsansms", 55)
-FONT_MED = pg.font.SysFont("comicsansms", 42)
-FONT_SMED = pg.font.SysFont("comicsansms", 29)
-FONT_SMALL = pg.font.SysFont("comicsansms", 25)
-FONT_TINY = pg.font.SysFont("comicsansms", 20)
+if not HEADLESS:
+    FONT_LARGE = pg.font.SysFont("comicsansms", 110)
+    FONT_BIG = pg.font.SysFont("comicsansms", 55)
+    FONT_MED = pg.font.SysFont("comicsansms", 42)
+    FONT_SMED = pg.font.SysFont("comicsansms", 29)
+    FONT_SMALL = pg.font.SysFont("comicsansms", 25)
+    FONT_TINY = pg.font.SysFont("comicsansms", 20)
+else:
+    FONT_LARGE = FONT_BIG = FONT_MED = FONT_SMED = FONT_SMALL = FONT_TINY = None
 
 TILE_SIZE = math.floor((min(WIDTH, HEIGHT) / 8.36))
 BULLET_SIZE = int(TILE_SIZE * 0.8)
@@ -27,17 +36,33 @@ TILE_SPRITE_SIZE = TILE_SIZE - 10  # this offset needs to be even for the player
 # not used rn
 
 # loading screen
-_screen.fill(colors.BLUE)
-_render = FONT_BIG.render("LOADING...", True, pg.Color("white"))
-_screen.blit(_render, _render.get_rect(center=SCREEN_RECT.center))
-pg.display.update()
-
-pg.joystick.init()
-joysticks = [pg.joystick.Joystick(i) for i in range(pg.joystick.get_count())]
+if not HEADLESS:
+    _screen.fill(colors.BLUE)
+    _render = FONT_BIG.render("LOADING...", True, pg.Color("white"))
+    _screen.blit(_render, _render.get_rect(center=SCREEN_RECT.center))
+    pg.display.update()
+
+    pg.joystick.init()
+    joysticks = [pg.joystick.Joystick(i) for i in range(pg.joystick.get_count())]
+else:
+    joysticks = []
 # work if controller is connected via BT (otherwise 2 controllers are visible) dunno why :<, but it can be drivers issue
 
 MAX_PLAYERS = 4
 CAN_PATHS_CROSS = True
+USE_SOLDIER_ENGINE = False  # simulate the soldiers with numpy arrays, see components.soldier_engine
+MAX_BACKGROUND_REDRAWS = 4  # areas of the game background redrawn per frame at most, more changes are redrawn at once
+STATE_BROADCAST_DELAY = 0.5  # in s, how often the host sends the game state. The clients predict the soldiers between
+STATE_BROADCAST_TICK = 0.05  # in s, the changes made by the players' commands are sent together this often
+STATE_IMMEDIATE_ACK = False  # the player who sent a command gets the state at once instead of on the broadcast tick
+LOCKSTEP = False  # online games relay only the commands and every peer simulates the game, see networking.lockstep
+LOCKSTEP_INPUT_DELAY = 6  # ticks between sending a command and executing it, covers the trip through the server
+LOCKSTEP_MAX_CATCHUP = 4  # max ticks simulated per update by a peer which has fallen behind
+LOCKSTEP_CHECKSUM_INTERVAL = 60  # ticks between the state checksums the peers report
+NET_OVERLAY_REFRESH = 500  # in ms, how often the network stats shown by F7 are rendered again
+SOLDIER_CORRECTION_DECAY = 0.85  # part of a predicted soldier's drawn offset left after a tick, see Soldier.draw_offset
+SOLDIER_SNAP_DISTANCE = TILE_SIZE * 2  # soldiers mispredicted by more than this jump to the received position
+PROFILE_LOG_PATH = os.environ.get('RTS_PROFILE_LOG')  # if set, frame timings are appended there, see profiling
 MAX_GOLD = 9999
 
 PLAYER_1 = 1
@@ -168,4 +193,21 @@ def load_gfx_from_dirs(dirs):
     return GFX
 
 
-gfx = load_gfx_from_dirs(['buildings', 'units', 'utils'])
+def stub_gfx_from_dirs(dirs, accept=(".png", ".jpg", ".bmp")):
+    """
+    Headless replacement of load_gfx_from_dirs. Only lists the graphics without decoding them.
+    Every name maps to the same blank 1x1 surface, so the sprites scaled from it have the right sizes.
+    """
+    base_path = os.path.join("project", "resources", "graphics")
+    stub = pg.Surface((1, 1))
+    GFX = {}
+    for directory in dirs:
+        names = [os.path.splitext(pic) for pic in os.listdir(os.path.join(base_path, directory))]
+        GFX[directory] = {name: stub for name, ext in names if ext.lower() in accept}
+    return GFX
+
+
+if HEADLESS:
+    gfx = stub_gfx_from_dirs(['buildings', 'units', 'utils'])
+else:
+    gfx = load_gfx_from_dirs(['buildings', 'units', 'utils'])
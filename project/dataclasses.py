@@ -17,3 +17,4 @@ class GameData:
     server: Optional[Server]
     client: Optional[Client]
     map: MapConfig
+    lockstep: bool = False  # the peers simulate the game themselves, see networking.lockstep
@@ -0,0 +1,119 @@
+"""
+Dedicated server. Hosts a match without a display, every player joins it as a client.
+The lobby waits until the given number of players have connected, then the match starts on the chosen map.
+The server simulates the board at the game's fixed rate and broadcasts the states, once everyone has left
+it goes back to the lobby (or stops, if it hosts a single match).
+Run it with the dedicated_server.py script from the repository's root directory.
+project.matches runs one in a worker process per match.
+"""
+import time
+
+from project import config, tools
+from project.dataclasses import GameData, MapConfig
+from project.networking import Server, Receiver, Packable, codec
+from project.states.game import Game
+
+LOBBY_UPDATE_DELAY = 0.2  # in s, how often the lobby state is sent
+MAX_CATCHUP = 5  # ticks run at most to catch up after a stall, the rest are skipped
+LOBBY_IDLE_TIMEOUT = 60  # in s, a single match's lobby nobody is in stops after this long
+
+
+def get_player_count(layout):
+    return sum(char.isdigit() for char in layout)
+
+
+def set_broadcast_rate(rate):
+    """ How many times per second the changes are sent. The simulation rate is fixed, the clients predict at it """
+    config.STATE_BROADCAST_TICK = 1 / rate
+
+
+class DedicatedServer(Packable, Receiver):
+    """ Runs the lobby and the game in the main thread, the Server ships the states from its own thread """
+    state_schema = 'lobby'  # the lobby state, the game registers itself as the source while it runs
+
+    def __init__(self, map_name, players, port=5555, max_clients=4, single_match=False):
+        self.map_names = list(config.MAPS)
+        self.map_index = self.map_names.index(map_name)
+        self.players = players
+        self.tick_duration = tools.TIME_PER_UPDATE / 1000  # in s, the same as the clients'
+        self.single_match = single_match  # stop once everyone has left the match instead of reopening the lobby
+        self.joined = False  # has anyone connected to the lobby yet
+        self.last_client_time = time.time()  # when was someone last seen in the lobby
+        self.server = Server(self, port, max_clients)
+        self.server.set_state_source(self, update_delay=LOBBY_UPDATE_DELAY)
+        self.game = None
+        self.running = True
+
+    def get_map_config(self):
+        name = self.map_names[self.map_index]
+        return MapConfig(player_no=self.players, name=name, layout=config.MAPS[name])
+
+    def pack(self):
+        return {
+            'map_index': self.map_index,
+            'clients': self.server.clients,
+        }
+
+    def unpack(self, data):
+        pass  # the server owns the lobby
+
+    def handle_message(self, message):
+        pass  # the players' actions are queued by the server and executed by the game
+
+    def start_game(self):
+        map_config = self.get_map_config()
+        print(f'Starting the game on {map_config.name} with {self.players} players')
+        self.server.clear_state_source()  # no lobby state may follow the init
+        self.server.send_to_clients(codec.encode_init(map_config))
+        self.game = Game()
+        self.game.startup(0, {'game_data': GameData(server=self.server, client=None, map=map_config)})
+
+    def end_game(self):
+        self.game.board.clear()
+        self.game = None
+        if self.single_match:
+            print('Everyone has left, stopping')
+            self.running = False
+            return
+        print('Everyone has left, back to the lobby')
+        self.server.set_state_source(self, update_delay=LOBBY_UPDATE_DELAY)
+
+    def update(self, now):
+        """ Advances the lobby or the game by one tick """
+        if self.game is None:
+            if all(self.server.clients[:self.players]):  # the players' ids match the castles
+                self.start_game()
+            elif self.server.get_client_count():
+                self.joined = True
+                self.last_client_time = time.time()
+                self.server.update_state()
+            elif self.single_match and (self.joined or time.time() - self.last_client_time > LOBBY_IDLE_TIMEOUT):
+                print('The lobby is empty, stopping')
+                self.running = False
+        elif self.server.get_client_count() == 0:
+            self.end_game()
+        else:
+            self.game.update(None, now)
+
+    def run(self):
+        """ Ticks at the fixed rate until interrupted """
+        self.server.run()
+        print(f'Waiting for {self.players} players, {self.map_names[self.map_index]}, '
+              f'{1 / config.STATE_BROADCAST_TICK:.1f} broadcasts/s')
+        start = time.perf_counter()
+        next_tick = start
+        try:
+            while self.running:
+                now = time.perf_counter()
+                steps = 0
+                while now >= next_tick and steps < MAX_CATCHUP:
+                    self.update(int((next_tick - start) * 1000))
+                    next_tick += self.tick_duration
+                    steps += 1
+                if now >= next_tick:  # stalled for too long, skip the ticks instead of rushing
+                    next_tick = now + self.tick_duration
+                time.sleep(max(0.0, next_tick - time.perf_counter()))
+        except KeyboardInterrupt:
+            print('Stopping the server')
+        finally:
+            self.server.close()
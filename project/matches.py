@@ -0,0 +1,125 @@
+"""
+Match server. Hosts many matches at once, each one is a DedicatedServer running in its own worker process,
+so the matches simulate on separate cores. The front-end listens on the main port: a client sends "join:match_id"
+and gets "redirect:port" of the match's worker, which is started by the first player joining the match.
+A worker stops once everyone has left its match or its lobby and its port can be reused.
+Run it with dedicated_server.py --matches from the repository's root directory.
+"""
+import asyncio
+import multiprocessing
+import signal
+import threading
+
+from project.networking.framing import FrameBuffer, FramingError, RECV_SIZE, encode_frame
+
+WORKER_START_TIMEOUT = 15  # in s, importing the game takes a while
+JOIN_TIMEOUT = 5  # in s, how long the front-end waits for the join command
+
+
+def run_match(match_id, map_name, players, broadcast_rate, port, max_clients, ready):
+    """ Entry point of a worker process. Sets the ready event once the match's port is open """
+    from project import dedicated  # headless, the RTS_HEADLESS variable is inherited from the front-end
+
+    if broadcast_rate:
+        dedicated.set_broadcast_rate(broadcast_rate)
+    match = dedicated.DedicatedServer(map_name, players, port, max_clients, single_match=True)
+    ready.set()  # the connections wait in the listen backlog until the server's loop accepts them
+    match.run()
+
+
+class MatchServer:
+    """ The front-end. Routes the connecting clients to the matches by the match id """
+    def __init__(self, map_name, players, broadcast_rate=None, port=5555, max_matches=4, max_clients=4):
+        self.map_name = map_name
+        self.players = players
+        self.broadcast_rate = broadcast_rate  # None keeps the game's default
+        self.ip = ''
+        self.port = port
+        self.match_ports = [port + 1 + i for i in range(max_matches)]
+        self.max_clients = max_clients
+        self.workers = {}  # match id -> (process, port)
+        self.lock = threading.Lock()  # the workers are started by the executor's threads
+        self.context = multiprocessing.get_context('spawn')  # a fresh interpreter, no threads copied
+
+    def get_match_port(self, match_id):
+        """ Returns the port of the match, starts its worker if needed. None if there is no room for it """
+        with self.lock:
+            self.reap()
+            if match_id in self.workers:
+                return self.workers[match_id][1]
+            used = {port for _, port in self.workers.values()}
+            free = [port for port in self.match_ports if port not in used]
+            if not free:
+                return None
+            ready = self.context.Event()
+            process = self.context.Process(target=run_match, daemon=True,
+                                           args=(match_id, self.map_name, self.players, self.broadcast_rate,
+                                                 free[0], self.max_clients, ready))
+            process.start()
+            if not ready.wait(WORKER_START_TIMEOUT):
+                print(f'The worker of the match {match_id} has failed to start')
+                process.terminate()
+                return None
+            self.workers[match_id] = (process, free[0])
+            print(f'Started the match {match_id} on port {free[0]}')
+            return free[0]
+
+    def reap(self):
+        """ Forgets the workers whose matches have ended """
+        for match_id, (process, port) in list(self.workers.items()):
+            if not process.is_alive():
+                process.join()
+                del self.workers[match_id]
+                print(f'The match {match_id} has ended')
+
+    def run(self):
+        print(f'Match server listening on {self.ip} : {self.port}, matches on ports '
+              f'{self.match_ports[0]}-{self.match_ports[-1]}')
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            print('Stopping the match server')
+        finally:
+            with self.lock:
+                for process, _ in self.workers.values():
+                    if process.is_alive():
+                        process.terminate()
+                for process, _ in self.workers.values():
+                    process.join()
+            print('The match server has stopped')
+
+    async def _serve(self):
+        stopped = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+        except (NotImplementedError, AttributeError):  # no signal handlers in the Windows loops
+            pass
+        server = await asyncio.start_server(self._handle_connection, self.ip, self.port, reuse_address=True)
+        async with server:
+            await stopped.wait()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            comms = (await asyncio.wait_for(self._read_command(reader), JOIN_TIMEOUT)).split(':', 1)
+            if comms[0] == 'join' and len(comms) == 2:  # command "join:match_id"
+                port = await asyncio.get_running_loop().run_in_executor(None, self.get_match_port, comms[1])
+                reply = f'redirect:{port}' if port else 'full'
+            else:
+                reply = 'unknown command'
+            writer.write(encode_frame(str.encode(reply)))
+            await writer.drain()
+        except (FramingError, ConnectionError, asyncio.TimeoutError) as e:
+            print('Dropping the connection', writer.get_extra_info('peername'), e)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        frames = FrameBuffer()
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                raise ConnectionError('closed before joining a match')
+            frames.feed(data)
+            for frame in frames.pop_all():
+                return frame.decode()
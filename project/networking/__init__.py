@@ -1,4 +1,5 @@
+from .client_data import ClientData
 from .client import Client
-from .server import Server, ClientData
+from .server import Server
 from .packable import Packable
 from .receiver import Receiver
\ No newline at end of file
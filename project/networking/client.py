@@ -1,20 +1,32 @@
 import socket
-import pickle
+import threading
+import time
+from collections import OrderedDict, deque
 from _thread import *
+from project.networking import codec, delta, stats
+from project.networking.framing import FrameBuffer, FramingError, HEADER, send_frame, recv_frame
 
 
 class Client:
-    def __init__(self, receiver, name: str, ip: str = '127.0.0.1', is_scout=False):
+    def __init__(self, receiver, name: str, ip: str = '127.0.0.1', is_scout=False, port=5555, match=None):
         self.receiver = receiver
         self.name: str = name
         self.ip = ip if ip != '' else '127.0.0.1'
         self.socket: socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.addr: (str, int) = (self.ip, 5555)
+        self.addr: (str, int) = (self.ip, port)
+        self.match = match  # if set, the address is a match server's front-end which redirects to the match
+        self.frames = FrameBuffer()  # frames following the player id are kept for the receiving thread
+        self.send_lock = threading.Lock()  # the receiving thread sends the acks
+        self.states = OrderedDict()  # seq -> received table of decoded records, the baselines of the server's deltas
+        self.stats = stats.NetStats()
+        # the receiving thread only decodes the messages, the main thread passes them to the receiver (see poll)
+        self.inbox = deque()  # the messages other than the states, they are all handled in order
+        self.latest_state = deque(maxlen=1)  # (schema, message) of the newest state, replaces the unhandled one
         self.player_id = self.connect()
         self.running = False
         if self.player_id and not is_scout:
             self.running = True
-            start_new_thread(threaded_client, (self.socket, lambda: self.running, lambda: self.receiver))
+            start_new_thread(threaded_client, (self,))
 
     def close(self):
         self.send(f'quit')
@@ -23,6 +35,10 @@ class Client:
     def get_player_id(self):
         return self.player_id
 
+    def get_stats(self):
+        """ Returns the traffic counters, see networking.stats """
+        return self.stats.get_stats()
+
     def connect(self):
         try:
             print('Connecting to address ', self.addr)
@@ -30,37 +46,115 @@ class Client:
             self.socket.connect(self.addr)
             self.socket.settimeout(None)
             print('Connected to address ', self.addr)
-            player_id = self.socket.recv(2048).decode()
+            if self.match:
+                self.join_match()
+            player_id = recv_frame(self.socket, self.frames)
+            if player_id is None:
+                raise ConnectionError('The server has closed the connection')
+            player_id = player_id.decode()
             print(f'received id {player_id}')
-            self.socket.sendall(str.encode(f'set_name:{self.name}'))
+            send_frame(self.socket, str.encode(f'set_name:{self.name}'))
             return player_id
         except Exception as e:
             print('Failed to connect to the server ', e)
             return None
 
+    def join_match(self):
+        """ Asks the front-end for the match's port and connects to the match instead """
+        send_frame(self.socket, str.encode(f'join:{self.match}'))
+        reply = recv_frame(self.socket, self.frames)
+        if reply is None:
+            raise ConnectionError('The match server has closed the connection')
+        comms = reply.decode().split(':')
+        if comms[0] != 'redirect':  # "full" - no room for another match
+            raise ConnectionError(f'Could not join the match {self.match}: {reply.decode()}')
+        self.socket.close()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.frames = FrameBuffer()
+        self.addr = (self.ip, int(comms[1]))
+        self.socket.settimeout(2)
+        self.socket.connect(self.addr)
+        self.socket.settimeout(None)
+        print(f'Joined the match {self.match} at', self.addr)
+
     def send(self, data):
         try:
             if type(data) == str:
-                self.socket.send(str.encode(data))
+                payload = str.encode(data)
+                with self.send_lock:
+                    send_frame(self.socket, payload)
+                self.stats.add_sent(len(payload) + HEADER.size)
             else:
                 raise ValueError("Client can only send strings")
         except socket.error as e:
             print("Could not send the project: " + str(e))
 
+    def poll(self):
+        """
+        Passes the received messages to the receiver. Called by the main thread between the updates,
+        so the receiver's state never changes in the middle of an update or a draw.
+        A state is passed only to a receiver sharing its schema, e.g. a game state doesn't reach the lobby
+        """
+        while self.inbox:
+            self._deliver(self.inbox.popleft())
+        try:
+            schema, message = self.latest_state.pop()
+        except IndexError:  # no new state
+            return
+        if getattr(self.receiver, 'state_schema', None) == schema.name:
+            self._deliver(message)
 
-def threaded_client(conn, is_running, receiver):
-    while is_running():
+    def _deliver(self, message):
         try:
-            data = conn.recv(4096*2)
-            if not data:
+            self.receiver.handle_message(message)
+        except (IndexError, KeyError):
+            print("Invalid data received, ignoring it")
+
+    def resolve_state(self, message):
+        """
+        Applies the received table delta and acknowledges it.
+        Returns the ('state', state) message for the receiver or None if the delta's baseline is unknown
+        """
+        _, schema, seq, base_seq, table_delta = message
+        if base_seq and base_seq not in self.states:
+            self.send('ack:0')  # no such baseline, ask for the whole state
+            return None
+        table = delta.apply(self.states[base_seq] if base_seq else schema.empty_table(), table_delta)
+        self.states[seq] = table
+        while len(self.states) > delta.BASELINE_HISTORY:
+            self.states.popitem(last=False)
+        self.send(f'ack:{seq}')
+        return 'state', schema.from_table(table)
+
+
+def threaded_client(client):
+    conn = client.socket
+    while client.running:
+        try:
+            data = recv_frame(conn, client.frames)
+            if data is None:
                 break
             else:
-                data = pickle.loads(data)
-                try:
-                    receiver().handle_message(data)
-                except IndexError:
-                    print("Invalid data received. Client quits")
-                    break
+                size = len(data) + HEADER.size
+                client.stats.add_received(size)
+                start = time.perf_counter()
+                data = codec.decode_message(data)
+                if data[0] == 'ping':  # answered at once, the server measures the round trip time
+                    client.send(f'pong:{data[1]!r}')
+                    client.stats.set_rtt(data[2])
+                    continue
+                if data[0] == 'state':
+                    client.stats.add_snapshot(size)
+                    schema = data[1]
+                    data = client.resolve_state(data)
+                    if data is not None:
+                        client.latest_state.append((schema, data))
+                else:
+                    client.inbox.append(data)
+                client.stats.add_deserialize_time((time.perf_counter() - start) * 1000)
+        except (FramingError, codec.CodecError) as e:
+            print("Invalid data received:", e)
+            break
         except socket.error as e:
             print("Something went wrong:", e)
             break
@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class ClientData:
+    """Class for storing basic client project."""
+    id: int
+    name: str = 'Joe'
+    address: str = '???'
@@ -0,0 +1,362 @@
+"""
+Binary wire format of the messages the server sends to the clients. Nothing received is unpickled.
+A state schema turns a packed state (see Packable.pack) into a record table: {section: {key: record bytes}}.
+Every record has a fixed struct layout (a path is followed by its tile indices), names are sent as small enums
+and positions as 16 bit fractions of the screen size. The deltas are computed over these tables (see networking.delta).
+"""
+import struct
+from project.building_stats import BUILDING_DATA, SOLDIER_STATS
+from project.networking.client_data import ClientData
+
+MSG_STATE, MSG_INIT, MSG_TICKS, MSG_DESYNC, MSG_PING = 1, 2, 3, 4, 5
+NONE_ID = 0xFFFF  # encodes None in the 16 bit id fields
+
+_MESSAGE_HEADER = struct.Struct('!B')
+_STATE_HEADER = struct.Struct('!BII')  # schema id, seq, baseline seq (0 if the delta is against an empty table)
+_SECTION_HEADER = struct.Struct('!BHH')  # section index, changed records, removed records
+_RECORD_HEADER = struct.Struct('!IH')  # key, record length
+_KEY = struct.Struct('!I')
+_STR_LEN = struct.Struct('!H')
+_INIT = struct.Struct('!B?')  # number of players, lockstep mode
+_TICKS = struct.Struct('!IH')  # first tick, number of ticks. Each tick is followed by its commands
+_COMMANDS = struct.Struct('!B')  # number of commands of a tick
+_COMMAND = struct.Struct('!B')  # player id, followed by the command string
+_DESYNC = struct.Struct('!I')  # tick
+_PING = struct.Struct('!dd')  # server's timestamp, the client's last round trip time in ms (negative if unknown)
+
+
+class CodecError(Exception):
+    """ The received bytes are not a valid message """
+    pass
+
+
+class Enum:
+    """ Maps a fixed list of names to small integers """
+    def __init__(self, names):
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+    def encode(self, name):
+        return self.ids[name]
+
+    def decode(self, value):
+        if value >= len(self.names):
+            raise CodecError(f'Unknown enum value {value}')
+        return self.names[value]
+
+
+BUILDING_NAMES = Enum([None] + list(BUILDING_DATA))
+SOLDIER_NAMES = Enum(SOLDIER_STATS)
+MENU_NAMES = Enum(['', 'build_menu', 'tower_upgrade_menu', 'barracks_upgrade_menu', 'market_upgrade_menu'])
+
+
+def encode_id(value):
+    return NONE_ID if value is None else value
+
+
+def decode_id(value):
+    return None if value == NONE_ID else value
+
+
+def quantize(value):
+    """ Relative position (0 - 1) -> 16 bit integer """
+    return min(0xFFFF, max(0, round(value * 0xFFFF)))
+
+
+def dequantize(value):
+    return value / 0xFFFF
+
+
+def encode_str(text):
+    data = text.encode()
+    return _STR_LEN.pack(len(data)) + data
+
+
+def decode_str(data, offset):
+    """ Returns the string and the offset after it """
+    (length,) = _STR_LEN.unpack_from(data, offset)
+    offset += _STR_LEN.size
+    if offset + length > len(data):
+        raise CodecError('String out of bounds')
+    return bytes(data[offset:offset + length]).decode(), offset + length
+
+
+class StateSchema:
+    """
+    Converts between a packed state and its record table. Subclasses define the sections
+    and how a record of each section is encoded. Decoded records are the parts of the packed state
+    """
+    id = 0
+    name = ''  # the state_schema of the state sources using it
+    sections = ()
+    fixed_records = {}  # section -> (struct, decoder method name) of the sections whose records have the same layout
+
+    def empty_table(self):
+        """ The baseline of the whole state """
+        return {section: {} for section in self.sections}
+
+    def to_table(self, state):
+        raise NotImplementedError
+
+    def from_table(self, table):
+        """ Builds the packed state from a table of decoded records """
+        raise NotImplementedError
+
+    def decode_record(self, section, key, data, offset):
+        """ Decodes the record starting at the offset of the received data """
+        raise NotImplementedError
+
+
+class GameSchema(StateSchema):
+    """ Game.pack(): the tiles with their buildings, the paths, the soldiers and the players """
+    id = 1
+    name = 'game'
+    sections = ('tiles', 'paths', 'soldiers', 'players')
+    TILE = struct.Struct('!BBf?H')  # owner, building name, health, is built, path id
+    PATH = struct.Struct('!BH')  # owner, number of tiles. Followed by the tile indices
+    SOLDIER = struct.Struct('!BHHfHHff?')  # name, x, y, hp, path index, path id, move vector, flipped
+    PLAYER = struct.Struct('!dfH??B')  # gold, income, tile index, build mode, upgrade mode, menu name
+    fixed_records = {'tiles': (TILE, 'decode_tile'), 'soldiers': (SOLDIER, 'decode_soldier'),
+                     'players': (PLAYER, 'decode_player')}
+
+    def to_table(self, state):
+        board = state['board']
+        return {
+            'tiles': {i: self.encode_tile(tile) for i, tile in enumerate(board['tiles'])},
+            'paths': {path['path_id']: self.encode_path(path) for path in board['paths']},
+            'soldiers': {soldier['id']: self.encode_soldier(soldier) for soldier in board['soldiers']},
+            'players': {player['id']: self.encode_player(player) for player in state['players']},
+        }
+
+    def from_table(self, table):
+        tiles = table['tiles']
+        return {
+            'board': {
+                'tiles': [tiles[i] for i in sorted(tiles)],
+                'paths': list(table['paths'].values()),
+                'soldiers': list(table['soldiers'].values()),
+            },
+            'players': list(table['players'].values()),
+        }
+
+    def decode_record(self, section, key, data, offset):
+        return self.decode_path(key, data, offset)  # the only section with records of different sizes
+
+    def encode_tile(self, tile):
+        building = tile['building'] or {'name': None, 'health': 0, 'is_built': False}
+        return self.TILE.pack(tile['owner'] or 0, BUILDING_NAMES.encode(building['name']), building['health'],
+                              building['is_built'], encode_id(building.get('path_id')))
+
+    @staticmethod
+    def decode_tile(index, owner, name, health, is_built, path_id):
+        building = None
+        if name:
+            building = {'name': BUILDING_NAMES.decode(name), 'health': health, 'is_built': is_built,
+                        'path_id': decode_id(path_id)}
+        return {'owner': owner or None, 'building': building}
+
+    def encode_path(self, path):
+        indices = path['tile_indices']
+        return self.PATH.pack(path['owner_id'], len(indices)) + struct.pack(f'!{len(indices)}H', *indices)
+
+    def decode_path(self, path_id, data, offset):
+        owner_id, count = self.PATH.unpack_from(data, offset)
+        indices = struct.unpack_from(f'!{count}H', data, offset + self.PATH.size)
+        return {'tile_indices': list(indices), 'owner_id': owner_id, 'path_id': path_id}
+
+    def encode_soldier(self, soldier):
+        x, y = soldier['pos']
+        move_vector = soldier['move_vector'] or (0, 0)  # None once the soldier's path is gone, it's dying then
+        return self.SOLDIER.pack(
+            SOLDIER_NAMES.encode(soldier['name']), quantize(x), quantize(y), soldier['hp'],
+            soldier['curr_path_index'], encode_id(soldier['path_id']), *move_vector, soldier['flipped'])
+
+    @staticmethod
+    def decode_soldier(soldier_id, name, x, y, hp, path_index, path_id, move_x, move_y, flipped):
+        return {'id': soldier_id, 'name': SOLDIER_NAMES.decode(name), 'pos': (dequantize(x), dequantize(y)),
+                'hp': hp, 'curr_path_index': path_index, 'path_id': decode_id(path_id),
+                'move_vector': (move_x, move_y), 'flipped': flipped}
+
+    def encode_player(self, player):
+        return self.PLAYER.pack(player['gold'], player['income'], player['tile_index'], player['in_build_mode'],
+                                player['in_upgrade_mode'], MENU_NAMES.encode(player['menu_name']))
+
+    @staticmethod
+    def decode_player(player_id, gold, income, tile_index, in_build_mode, in_upgrade_mode, menu_name):
+        return {'id': player_id, 'gold': gold, 'income': income, 'tile_index': tile_index,
+                'in_build_mode': in_build_mode, 'in_upgrade_mode': in_upgrade_mode,
+                'menu_name': MENU_NAMES.decode(menu_name)}
+
+
+class LobbySchema(StateSchema):
+    """ OnlineLobby.pack(): the selected map and the connected clients """
+    id = 2
+    name = 'lobby'
+    sections = ('lobby', 'clients')
+    LOBBY = struct.Struct('!H')  # map index
+    PORT = struct.Struct('!H')
+
+    def to_table(self, state):
+        return {
+            'lobby': {0: self.LOBBY.pack(state['map_index'])},
+            'clients': {client.id: encode_str(client.name) + encode_str(client.address[0]) +
+                        self.PORT.pack(client.address[1]) for client in state['clients'] if client},
+        }
+
+    def from_table(self, table):
+        return {
+            'map_index': table['lobby'][0],
+            'clients': [table['clients'][client_id] for client_id in sorted(table['clients'])],
+        }
+
+    def decode_record(self, section, key, data, offset):
+        if section == 'lobby':
+            return self.LOBBY.unpack_from(data, offset)[0]
+        name, offset = decode_str(data, offset)
+        ip, offset = decode_str(data, offset)
+        (port,) = self.PORT.unpack_from(data, offset)
+        return ClientData(id=key, name=name, address=(ip, port))
+
+
+SCHEMAS = {schema.id: schema for schema in (GameSchema(), LobbySchema())}
+
+
+def get_schema(name):
+    """ Returns the schema of the state source's state_schema name ('game' or 'lobby') """
+    return {schema.name: schema for schema in SCHEMAS.values()}[name]
+
+
+def encode_state(schema, seq, base_seq, table_delta):
+    """
+    Encodes the delta of two record tables (see networking.delta).
+    base_seq is the seq of the table the delta was made against, 0 if it is the whole table
+    """
+    parts = [_MESSAGE_HEADER.pack(MSG_STATE), _STATE_HEADER.pack(schema.id, seq, base_seq)]
+    for index, section in enumerate(schema.sections):
+        changed, removed = table_delta.get(section, ({}, []))
+        if not changed and not removed:
+            continue
+        parts.append(_SECTION_HEADER.pack(index, len(changed), len(removed)))
+        for key, record in changed.items():
+            parts.append(_RECORD_HEADER.pack(key, len(record)))
+            parts.append(record)
+        parts.extend(_KEY.pack(key) for key in removed)
+    return b''.join(parts)
+
+
+def encode_init(map_config, lockstep=False):
+    """ The message starting the game on the clients """
+    return (_MESSAGE_HEADER.pack(MSG_INIT) + _INIT.pack(map_config.player_no, lockstep) +
+            encode_str(map_config.name) + encode_str(map_config.layout))
+
+
+def encode_ticks(bundles):
+    """ The sealed lockstep bundles [(tick, [(player id, command)])] of consecutive ticks """
+    parts = [_MESSAGE_HEADER.pack(MSG_TICKS), _TICKS.pack(bundles[0][0], len(bundles))]
+    for tick, commands in bundles:
+        parts.append(_COMMANDS.pack(len(commands)))
+        for player_id, command in commands:
+            parts.append(_COMMAND.pack(player_id))
+            parts.append(encode_str(command))
+    return b''.join(parts)
+
+
+def encode_desync(tick):
+    return _MESSAGE_HEADER.pack(MSG_DESYNC) + _DESYNC.pack(tick)
+
+
+def encode_ping(timestamp, rtt):
+    return _MESSAGE_HEADER.pack(MSG_PING) + _PING.pack(timestamp, -1 if rtt is None else rtt)
+
+
+def decode_message(data):
+    """
+    Returns one of:
+        ('state', schema, seq, base_seq, delta of the tables of decoded records)
+        ('init', (player number, map name, map layout), lockstep mode)
+        ('ticks', [(tick, [(player id, command)])])
+        ('desync', tick)
+        ('ping', timestamp, round trip time in ms or None)
+    Raises CodecError if the data is malformed
+    """
+    try:
+        (message_type,) = _MESSAGE_HEADER.unpack_from(data)
+        offset = _MESSAGE_HEADER.size
+        if message_type == MSG_STATE:
+            return _decode_state(data, offset)
+        elif message_type == MSG_INIT:
+            player_no, lockstep = _INIT.unpack_from(data, offset)
+            name, offset = decode_str(data, offset + _INIT.size)
+            layout, offset = decode_str(data, offset)
+            return 'init', (player_no, name, layout), lockstep
+        elif message_type == MSG_TICKS:
+            return 'ticks', _decode_ticks(data, offset)
+        elif message_type == MSG_DESYNC:
+            return 'desync', _DESYNC.unpack_from(data, offset)[0]
+        elif message_type == MSG_PING:
+            timestamp, rtt = _PING.unpack_from(data, offset)
+            return 'ping', timestamp, rtt if rtt >= 0 else None
+    except (struct.error, UnicodeDecodeError, KeyError, IndexError) as e:
+        raise CodecError(f'Malformed message: {e}')
+    raise CodecError(f'Unknown message type {message_type}')
+
+
+_entry_structs = {}  # record struct -> struct of the record header followed by the record
+
+
+def _get_entry_struct(record_struct):
+    entry = _entry_structs.get(record_struct)
+    if entry is None:
+        entry = _entry_structs[record_struct] = struct.Struct(_RECORD_HEADER.format + record_struct.format[1:])
+    return entry
+
+
+def _decode_state(data, offset):
+    schema_id, seq, base_seq = _STATE_HEADER.unpack_from(data, offset)
+    offset += _STATE_HEADER.size
+    schema = SCHEMAS[schema_id]
+    table_delta = {}
+    while offset < len(data):
+        index, changed_count, removed_count = _SECTION_HEADER.unpack_from(data, offset)
+        offset += _SECTION_HEADER.size
+        section = schema.sections[index]
+        changed = {}
+        if section in schema.fixed_records:  # all the records have the same size, unpack them in one pass
+            record_struct, decoder = schema.fixed_records[section]
+            entry = _get_entry_struct(record_struct)
+            end = offset + changed_count * entry.size
+            if end > len(data):
+                raise CodecError('Records out of bounds')
+            entries = list(entry.iter_unpack(data[offset:end]))
+            if any(fields[1] != record_struct.size for fields in entries):
+                raise CodecError('Invalid record length')
+            decode = getattr(schema, decoder)
+            changed = {fields[0]: decode(fields[0], *fields[2:]) for fields in entries}
+            changed_count, offset = 0, end
+        for _ in range(changed_count):
+            key, length = _RECORD_HEADER.unpack_from(data, offset)
+            offset += _RECORD_HEADER.size
+            if offset + length > len(data):
+                raise CodecError('Record out of bounds')
+            changed[key] = schema.decode_record(section, key, data, offset)
+            offset += length
+        removed = [_KEY.unpack_from(data, offset + i * _KEY.size)[0] for i in range(removed_count)]
+        offset += removed_count * _KEY.size
+        table_delta[section] = (changed, removed)
+    return 'state', schema, seq, base_seq, table_delta
+
+
+def _decode_ticks(data, offset):
+    first_tick, tick_count = _TICKS.unpack_from(data, offset)
+    offset += _TICKS.size
+    bundles = []
+    for tick in range(first_tick, first_tick + tick_count):
+        (command_count,) = _COMMANDS.unpack_from(data, offset)
+        offset += _COMMANDS.size
+        commands = []
+        for _ in range(command_count):
+            (player_id,) = _COMMAND.unpack_from(data, offset)
+            command, offset = decode_str(data, offset + _COMMAND.size)
+            commands.append((player_id, command))
+        bundles.append((tick, commands))
+    return bundles
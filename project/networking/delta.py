@@ -0,0 +1,31 @@
+"""
+Deltas between two record tables (see networking.codec). A table maps the section names to {key: record}.
+The server sends a client only the records which have changed since the last table the client has acknowledged
+and the keys of the records which are gone. The whole table is sent as the delta against an empty table.
+Tables are copied on write, so the baselines stay untouched.
+"""
+BASELINE_HISTORY = 32  # number of the last states both sides keep as the possible baselines
+
+
+def diff(old, new):
+    """ Returns {section: (changed records {key: record}, removed keys)} turning the old table into the new one """
+    delta = {}
+    for section, records in new.items():
+        old_records = old.get(section, {})
+        changed = {key: record for key, record in records.items() if old_records.get(key) != record}
+        removed = [key for key in old_records if key not in records]
+        if changed or removed:
+            delta[section] = (changed, removed)
+    return delta
+
+
+def apply(old, delta):
+    """ Returns the table the delta was made from. Doesn't modify old """
+    new = dict(old)
+    for section, (changed, removed) in delta.items():
+        records = dict(old.get(section, {}))
+        records.update(changed)
+        for key in removed:
+            records.pop(key, None)
+        new[section] = records
+    return new
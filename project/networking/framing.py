@@ -0,0 +1,69 @@
+"""
+Length prefixed framing of the messages sent over the tcp sockets.
+Every message is sent as a 4 byte big endian length followed by the payload. Tcp may split a message
+or coalesce several of them, the FrameBuffer reassembles the received bytes back into whole messages.
+"""
+import struct
+from collections import deque
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # protects against allocating garbage lengths
+RECV_SIZE = 64 * 1024
+
+
+class FramingError(Exception):
+    """ The stream doesn't hold valid frames. The connection should be closed """
+    pass
+
+
+def encode_frame(payload: bytes) -> bytes:
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FramingError(f'Frame of {len(payload)} bytes is too big')
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload: bytes):
+    sock.sendall(encode_frame(payload))
+
+
+class FrameBuffer:
+    """ Streaming reassembly buffer of one connection """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.frames = deque()  # complete payloads waiting to be popped
+
+    def feed(self, data: bytes):
+        """ Appends the received bytes and splits off all the complete frames """
+        self.buffer += data
+        start = 0
+        while len(self.buffer) - start >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, start)
+            if length > self.max_frame_size:
+                raise FramingError(f'Frame of {length} bytes announced')
+            end = start + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            self.frames.append(bytes(self.buffer[start + HEADER.size:end]))
+            start = end
+        del self.buffer[:start]
+
+    def pop(self) -> bytes:
+        return self.frames.popleft()
+
+    def pop_all(self):
+        frames, self.frames = list(self.frames), deque()
+        return frames
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def recv_frame(sock, buffer: FrameBuffer):
+    """ Blocks until a whole frame is received and returns its payload. Returns None if the connection was closed """
+    while not buffer:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return None
+        buffer.feed(data)
+    return buffer.pop()
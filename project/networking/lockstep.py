@@ -0,0 +1,73 @@
+"""
+Lockstep mode of the online game. Instead of the states, the server relays only the players' commands.
+The commands are gathered into per tick bundles which the server seals in order at the simulation rate.
+The sealing starts once all the peers have reported they are ready.
+Every peer (the host included) executes the bundle of a tick and advances its own board by one tick,
+a peer waits if the next bundle hasn't arrived yet. The peers report the checksums of their states now and then,
+the server compares them to detect the desyncs.
+"""
+import zlib
+from collections import OrderedDict
+
+CHECKSUM_HISTORY = 8  # number of the last checksummed ticks the server compares
+
+
+def state_checksum(packable):
+    """ Checksum of the packed state. Equal on all the peers as long as their simulations agree """
+    return zlib.crc32(repr(packable.pack()).encode())
+
+
+class InputRelay:
+    """ Server side. Collects the commands and seals them into the tick bundles """
+    def __init__(self, player_ids):
+        self.unready = set(player_ids)  # the peers which haven't started their game yet
+        self.sealed_tick = 0  # the last tick whose bundle has been sent
+        self.pending = {}  # tick -> [(player id, command)] in the order of arrival
+        self.checksums = OrderedDict()  # tick -> {player id: checksum}
+        self.desync_tick = None  # the first tick the peers have disagreed on
+
+    def set_ready(self, player_id):
+        self.unready.discard(player_id)
+
+    def add_input(self, player_id, command, tick=None):
+        """ Commands arriving too late for their target tick are executed at the first unsealed one """
+        tick = self.sealed_tick + 1 if tick is None else max(tick, self.sealed_tick + 1)
+        self.pending.setdefault(tick, []).append((player_id, command))
+
+    def seal(self, tick):
+        """ Returns [(tick, commands)] of all the ticks up to the given one which haven't been sealed yet """
+        bundles = []
+        while self.sealed_tick < tick:
+            self.sealed_tick += 1
+            bundles.append((self.sealed_tick, self.pending.pop(self.sealed_tick, [])))
+        return bundles
+
+    def add_checksum(self, player_id, tick, checksum):
+        """ Returns True if the checksum reveals a new desync """
+        values = self.checksums.setdefault(tick, {})
+        values[player_id] = checksum
+        while len(self.checksums) > CHECKSUM_HISTORY:
+            self.checksums.popitem(last=False)
+        if self.desync_tick is None and len(set(values.values())) > 1:
+            self.desync_tick = tick
+            return True
+        return False
+
+
+class TickBundles:
+    """ Peer side. The received bundles waiting for the board to reach their tick """
+    def __init__(self):
+        self.bundles = {}  # tick -> [(player id, command)]
+
+    def put(self, tick, commands):
+        self.bundles[tick] = commands
+
+    def pop(self, tick):
+        """ Returns the commands of the tick or None if its bundle hasn't arrived yet """
+        return self.bundles.pop(tick, None)
+
+    def clear(self):
+        self.bundles.clear()
+
+    def __len__(self):
+        return len(self.bundles)
@@ -1,19 +1,12 @@
+import asyncio
 import socket
-import select
 import threading
-import sys
-from dataclasses import dataclass
 from typing import List, Optional
-import pickle
 import time
-
-
-@dataclass
-class ClientData:
-    """Class for storing basic client project."""
-    id: int
-    name: str = 'Joe'
-    address: str = '???'
+from collections import OrderedDict, deque
+from project.networking import codec, delta, lockstep, stats
+from project.networking.client_data import ClientData
+from project.networking.framing import FrameBuffer, FramingError, RECV_SIZE, encode_frame
 
 
 def threaded(fn):
@@ -24,95 +17,407 @@ def threaded(fn):
     return wrapper
 
 
+class Connection:
+    """
+    A connected client. Frames are sent by its own writer task, so a slow client delays only itself.
+    The reliable frames are queued and sent in order. Of the states only the newest unsent one is kept:
+    every state is a delta against the last one the client has acknowledged, so the stale ones can be dropped
+    """
+    def __init__(self, reader, writer, client_index):
+        self.reader = reader
+        self.writer = writer
+        self.client_index = client_index  # index in Server.clients, the player's id is client_index + 1
+        self.frames = FrameBuffer()
+        self.outbox = deque()  # reliable encoded frames waiting to be written
+        self.pending_state = None  # the newest encoded state waiting to be written
+        self.dropped_states = 0  # states replaced by a newer one before they could be written
+        self.wakeup = asyncio.Event()  # set when there is something to write
+        self.acked_seq = None  # seq of the last state the client has acknowledged
+        self.task = asyncio.current_task()  # the reader task handling the connection
+        self.last_state_time = 0  # when was the last state sent to the client
+        self.rtt = None  # in ms, measured by the pings
+
+    def send(self, frame):
+        """ Must be called from the server's event loop """
+        self.outbox.append(frame)
+        self.wakeup.set()
+
+    def send_state(self, frame):
+        """ Must be called from the server's event loop. Replaces the unsent state """
+        if self.pending_state is not None:
+            self.dropped_states += 1
+        self.pending_state = frame
+        self.wakeup.set()
+
+    def get_backlog(self):
+        """ Returns the number of frames waiting to be written """
+        return len(self.outbox) + (self.pending_state is not None)
+
+    def pop_frame(self):
+        """ Returns the next frame to write, the reliable ones go first. None if there is nothing to write """
+        if self.outbox:
+            return self.outbox.popleft()
+        frame, self.pending_state = self.pending_state, None
+        return frame
+
+
 class Server:
-    def __init__(self, receiver):
+    """
+    Runs an asyncio event loop in its own thread. Every connection has a reader and a writer task.
+    The state is packed by the state source's thread between its ticks (see update_state), the event loop
+    only ships the encoded frames. The commands don't trigger a state each, the changes they have made
+    go out together on the next broadcast tick.
+    The methods not starting with an underscore can be called from any thread
+    """
+    def __init__(self, receiver, port=5555, max_clients=4):
         self.receiver = receiver
         self.ip = ''
-        self.port = 5555
+        self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.ip, self.port))
-        self.server_socket.listen(4)
+        self.server_socket.listen(max_clients)
+        self.server_socket.setblocking(False)
         print(f"Listening on {self.ip} : {self.port}")
 
-        self.socket_id_dict = {}  # maps sockets to clients ids
-        self.host_socket = None
-        self.clients: List[Optional[ClientData]] = [None] * 4
-        self.read_list = [self.server_socket]
+        self.connections: List[Connection] = []
+        self.clients: List[Optional[ClientData]] = [None] * max_clients  # the players past the castles spectate
         self.running = True
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id = None
+        self.stopped: Optional[asyncio.Event] = None  # set by close() to end the event loop
         self.last_state_update = 0
-        self.state_update_delay = 0.5  # in s
+        self.state_update_delay = 0.5  # in s, the state is sent at least this often
+        self.broadcast_delay = 0.05  # in s, the broadcast tick. The state is sent at most this often
+        self.state_changed = False  # a command has been received since the last state
+        self.immediate_ack = False  # the commanding client gets the state at once, unless it got one this tick
         self.state_source = None  # packable object whose state is going to be shared among the players
+        self.state_schema = None  # codec schema of the state source, named by its state_schema attribute
+        self.state_lock = threading.Lock()  # guards the state source and the baselines
+        self.ack_requests = set()  # connections waiting for an immediate state after their command
+        self.state_seq = 0  # sequence number of the last sent state
+        self.sent_states = OrderedDict()  # seq -> record table, the baselines the deltas are made against
+        self.keyframe_interval = 30  # every n-th state is sent whole to everyone
+        self.lockstep: Optional[lockstep.InputRelay] = None  # relays the commands instead of the states if set
+        self.tick_duration = None  # in s, how often the lockstep bundles are sealed
+        self.seal_task: Optional[asyncio.Task] = None
+        self.ready_peers = set()  # ids of the peers which have started their lockstep game, even before the relay
+        self.stats = stats.NetStats()
+        self.commands = deque()  # (player id, command, arrival time, arrival tick) of the actions waiting to run
+        self.executed = []  # arrival times of the executed commands which no state has included yet
+        self.tick = 0  # the state source's tick, the received commands are stamped with it
+
+    def set_state_source(self, packable, update_delay=0.5, broadcast_delay=0.05, immediate_ack=False):
+        with self.state_lock:
+            self.state_source = packable
+            self.state_schema = codec.get_schema(packable.state_schema)
+            self.state_update_delay = update_delay
+            self.broadcast_delay = min(broadcast_delay, update_delay)
+            self.immediate_ack = immediate_ack
+            self.commands.clear()  # they were meant for the previous source
+            self.executed.clear()
+            self.ack_requests.clear()
+            self.sent_states.clear()  # tables of a different schema can't be the baselines
+            self.ready_peers.clear()  # they were ready for the previous game
+        self._call_in_loop(self._drop_pending_states)  # a stale state of the old schema must not follow
 
-    def set_state_source(self, packable, update_delay=0.5):
-        self.state_source = packable
-        self.state_update_delay = update_delay
+    def clear_state_source(self):
+        """
+        Stops sending the states and drops the unsent ones. Call it before telling the clients to switch
+        to another state source, so no state of the old one reaches them after the switch
+        """
+        with self.state_lock:
+            self.state_source = None
+            self.state_schema = None
+            self.sent_states.clear()
+        self._call_in_loop(self._drop_pending_states)
+
+    def _drop_pending_states(self):
+        for connection in list(self.connections):
+            connection.pending_state = None
+
+    def start_lockstep(self, tick_duration):
+        """ Stops sending the states. From now on the commands are relayed in the tick bundles """
+        self.clear_state_source()
+        with self.state_lock:
+            self.lockstep = lockstep.InputRelay([connection.client_index+1 for connection in list(self.connections)])
+            self.tick_duration = tick_duration
+        for player_id in list(self.ready_peers):  # the peers which have started their game before the host
+            self.lockstep.set_ready(player_id)
+        self._call_in_loop(self._start_sealing)
+
+    def pop_commands(self):
+        """
+        Returns the received actions [(player id, command, arrival time, arrival tick)] in the order of arrival.
+        The state source executes them in its own thread, so they never race the simulation
+        """
+        commands = []
+        while self.commands:
+            commands.append(self.commands.popleft())
+        return commands
+
+    def command_executed(self, arrival_time, arrival_tick, tick):
+        """
+        Called by the state source after executing a popped command on the given tick.
+        The command's latency is measured once the first state including its effect is sent
+        """
+        self.executed.append(arrival_time)
+        self.stats.add_command_ticks(tick - arrival_tick)
+
+    def get_stats(self):
+        """ Returns the traffic counters (see networking.stats) and the send backlog of every client """
+        result = self.stats.get_stats()
+        result['clients'] = {
+            connection.client_index+1: {
+                'backlog': connection.get_backlog(),
+                'dropped_states': connection.dropped_states,
+                'buffered_bytes': connection.writer.transport.get_write_buffer_size(),
+                'rtt_ms': connection.rtt,
+            } for connection in list(self.connections)}
+        return result
 
     def get_client_count(self):
-        return len(self.socket_id_dict)
+        return len(self.connections)
 
     def _get_available_id(self):
         for i, v in enumerate(self.clients):
             if not v:
                 return i
+        return None
 
     def close(self):
         self.running = False
+        self._call_in_loop(lambda: self.stopped.set())
+
+    def _call_in_loop(self, fn, *args):
+        """ Runs the function in the event loop's thread """
+        if self.loop is None:
+            return
+        if threading.get_ident() == self.loop_thread_id:
+            fn(*args)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(fn, *args)
+            except RuntimeError:  # the loop has already been closed
+                pass
 
     def send_to_clients(self, data):
-        for s in self.read_list:
-            if s != self.server_socket:
-                s.sendall(data)
-
-    def _remove_client(self, sckt):
-        self.clients[self.socket_id_dict[sckt]] = None
-        # print(self.clients)
-        del self.socket_id_dict[sckt]
-
-    def add_client(self, sckt, addr):
-        new_id = self._get_available_id()
-        self.clients[new_id] = ClientData(id=new_id+1, address=addr)
-        self.socket_id_dict.update({sckt: new_id})
-        self.read_list.append(sckt)
-        sckt.sendall(str.encode(str(new_id+1)))
-        self.send_state()
-        if self.host_socket is None:
-            self.host_socket = sckt
-        print("Connection from", addr)
-
-    def send_state(self):
-        # print("SERVER sending state")
-        self.last_state_update = time.time()
-        self.send_to_clients(pickle.dumps(('state', self.state_source.pack())))
+        frame = encode_frame(data)  # framed once for all the clients
+        self._call_in_loop(self._send_frames, [(connection, frame) for connection in list(self.connections)])
+
+    @staticmethod
+    def _send_frames(targets):
+        for connection, frame in targets:
+            connection.send(frame)
+
+    @staticmethod
+    def _send_state_frames(targets):
+        for connection, frame in targets:
+            connection.send_state(frame)
+
+    def update_state(self, tick=None):
+        """
+        Called by the state source's thread between its ticks, so the state is never packed mid update.
+        The tick, if given, is the one the source has just finished, the commands arriving next are stamped with it.
+        Sends the state every state_update_delay seconds, or on the next broadcast tick if it has changed.
+        Otherwise sends it only to the clients waiting for an immediate ack
+        """
+        if tick is not None:
+            self.tick = tick
+        if self.state_source is None or not self.connections:
+            return
+        now = time.time()
+        delay = self.broadcast_delay if self.state_changed else self.state_update_delay
+        if now >= self.last_state_update + delay:
+            self.send_state()
+        elif self.ack_requests:
+            connections = [connection for connection in list(self.ack_requests)
+                           if now >= connection.last_state_time + self.broadcast_delay]
+            self.ack_requests.difference_update(connections)
+            if connections:
+                self.send_state(connections)
+
+    def send_state(self, connections=None):
+        """
+        Sends every client the records which have changed since the last state it has acknowledged.
+        Sends the whole state to the clients with no usable baseline and on every keyframe.
+        If the connections are given only they get the state.
+        Packs the state source, call it from the source's thread only. The state is encoded once per baseline,
+        the event loop just ships the frames
+        """
+        with self.state_lock:
+            if self.state_source is None:
+                return
+            start = time.perf_counter()
+            now = time.time()
+            if connections is None:
+                connections = list(self.connections)
+                self.last_state_update = now
+                self.state_changed = False
+                self.ack_requests.clear()  # they get this one
+            self.state_seq += 1
+            table = self.state_schema.to_table(self.state_source.pack())
+            for arrival_time in self.executed:  # the commands' effects are in this state
+                self.stats.add_command_latency((time.perf_counter() - arrival_time) * 1000)
+            self.executed.clear()
+            self.sent_states[self.state_seq] = table
+            while len(self.sent_states) > delta.BASELINE_HISTORY:
+                self.sent_states.popitem(last=False)
+
+            is_keyframe = self.state_seq % self.keyframe_interval == 0
+            frames = {}  # baseline seq -> encoded frame, clients with the same baseline get the same frame
+            targets = []
+            for connection in connections:
+                connection.last_state_time = now
+                base_seq = None if is_keyframe else connection.acked_seq
+                if base_seq not in self.sent_states:
+                    base_seq = None  # the client has fallen behind, send the whole state
+                if base_seq not in frames:
+                    base_table = self.sent_states[base_seq] if base_seq else self.state_schema.empty_table()
+                    message = codec.encode_state(self.state_schema, self.state_seq, base_seq or 0,
+                                                 delta.diff(base_table, table))
+                    frames[base_seq] = encode_frame(message)
+                    self.stats.add_snapshot(len(message))
+                targets.append((connection, frames[base_seq]))
+            self.stats.add_serialize_time((time.perf_counter() - start) * 1000)
+        self._call_in_loop(self._send_state_frames, targets)
+
+    def handle_command(self, connection, comms):
+        """ Handles a command received from the client. Returns False if the client has quit """
+        if comms[0] == 'set_name':  # command "set_name:name" - set the player's name
+            self.clients[connection.client_index].name = comms[1]
+        elif comms[0] == 'quit':  # command "quit" - player has quit
+            return False
+        elif comms[0] == 'ack':  # command "ack:seq" - client has applied the state, use it as the baseline
+            connection.acked_seq = int(comms[1])
+        elif comms[0] == 'action' and self.lockstep:  # command "action:command_name:tick" - queue it for the tick
+            tick = int(comms[2]) if len(comms) > 2 else None
+            self.lockstep.add_input(connection.client_index+1, comms[1], tick)
+        elif comms[0] == 'action':  # command "action: command_name"-player has performed an action
+            self.commands.append((connection.client_index+1, comms[1], time.perf_counter(), self.tick))
+        elif comms[0] == 'pong':  # command "pong:timestamp" - the answer to a ping
+            connection.rtt = (time.perf_counter() - float(comms[1])) * 1000
+            self.stats.set_rtt(connection.rtt)
+        elif comms[0] == 'ready':  # command "ready" - the peer has started the lockstep game
+            self.ready_peers.add(connection.client_index+1)  # it may be faster than the host's start_lockstep
+            if self.lockstep:
+                self.lockstep.set_ready(connection.client_index+1)
+        elif comms[0] == 'checksum' and self.lockstep:  # command "checksum:tick:value" - the peer's state checksum
+            tick = int(comms[1])
+            if self.lockstep.add_checksum(connection.client_index+1, tick, int(comms[2])):
+                print(f'Desync at tick {tick}:', self.lockstep.checksums[tick])
+                self.send_to_clients(codec.encode_desync(tick))
+        return True
 
     @threaded
     def run(self):
-        while self.running:
-            if time.time() > self.last_state_update + self.state_update_delay:
-                self.send_state()
-            sys.stdout.flush()
-            readable, writable, errored = select.select(self.read_list, [], [], 1)
-            for s in readable:
-                if s is self.server_socket:
-                    client_socket, address = self.server_socket.accept()
-                    self.add_client(client_socket, address)
-                else:
-                    data = s.recv(1024)
-                    if data:
-                        comms = data.decode().split(':')
-                        if comms[0] == 'set_name':  # command "set_name:name" - set the player's name
-                            self.clients[self.socket_id_dict[s]].name = comms[1]
-                        elif comms[0] == 'quit':  # command "quit" - player has quit
-                            self._remove_client(s)
-                            s.close()
-                            self.read_list.remove(s)
-                        elif comms[0] == 'action':  # command "action: command_name"-player has performed an action
-                            payload = ('action', self.socket_id_dict[s]+1, comms[1])
-                            self.state_source.handle_message(payload)
-                        self.send_state()  # send state after receiving a message
-                    else:
-                        s.close()
-                        self.read_list.remove(s)
-
+        asyncio.run(self._serve())
         self.server_socket.close()
         print('The server has stopped')
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.stopped = asyncio.Event()
+        if not self.running:  # closed before the loop has started
+            return
+        server = await asyncio.start_server(self._handle_connection, sock=self.server_socket)
+        ping = asyncio.create_task(self._ping())
+        await self.stopped.wait()
+        ping.cancel()
+        if self.seal_task:
+            self.seal_task.cancel()
+        server.close()
+        connections = list(self.connections)
+        for connection in connections:
+            connection.writer.close()  # the reader tasks see the end of the stream and finish
+        await asyncio.gather(*[connection.task for connection in connections], return_exceptions=True)
+
+    async def _ping(self):
+        """ Pings the clients, the round trip time is measured when their pongs arrive """
+        while self.running:
+            await asyncio.sleep(stats.PING_INTERVAL)
+            for connection in list(self.connections):
+                connection.send(encode_frame(codec.encode_ping(time.perf_counter(), connection.rtt)))
+
+    def _start_sealing(self):
+        if self.seal_task is None:
+            self.seal_task = asyncio.create_task(self._seal_ticks())
+
+    async def _seal_ticks(self):
+        """ Seals the lockstep bundles at the simulation rate. The peers can't advance past the last sealed tick """
+        while self.running and self.lockstep.unready:  # bundles sent before a peer's game has started would be lost
+            await asyncio.sleep(self.tick_duration)
+        start = self.loop.time()
+        while self.running:
+            tick = int((self.loop.time() - start) / self.tick_duration)
+            bundles = self.lockstep.seal(tick)
+            if bundles:
+                self.send_to_clients(codec.encode_ticks(bundles))
+            await asyncio.sleep(self.tick_duration)
+
+    async def _handle_connection(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        client_index = self._get_available_id()
+        if client_index is None:
+            print('The server is full, refusing', address)
+            writer.close()
+            return
+        connection = Connection(reader, writer, client_index)
+        self.clients[client_index] = ClientData(id=client_index+1, address=address)
+        self.connections.append(connection)
+        writer_task = asyncio.create_task(self._write_loop(connection))
+        connection.send(encode_frame(str.encode(str(client_index+1))))
+        self.state_changed = True  # everyone gets the new player with the next broadcast tick
+        print("Connection from", address)
+        try:
+            await self._read_loop(connection)
+        except FramingError as e:
+            print('Invalid frame received, closing the connection', e)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.remove(connection)
+            self.ack_requests.discard(connection)
+            self.clients[client_index] = None
+            if self.lockstep:
+                self.lockstep.set_ready(client_index+1)  # don't wait for it
+            writer_task.cancel()
+            writer.close()
+
+    async def _read_loop(self, connection):
+        while self.running:
+            data = await connection.reader.read(RECV_SIZE)
+            if not data:
+                return
+            connection.frames.feed(data)
+            frames = connection.frames.pop_all()
+            self.stats.add_received(len(data), len(frames))
+            changed = False
+            for frame in frames:
+                try:
+                    comms = frame.decode().split(':')
+                    if not self.handle_command(connection, comms):
+                        return
+                except (ValueError, IndexError) as e:  # a malformed command, UnicodeDecodeError included
+                    print(f'Invalid command from client {connection.client_index+1}, ignoring it:', frame[:64], e)
+                    continue
+                changed = changed or comms[0] not in ('ack', 'pong')
+            if changed:
+                self.state_changed = True  # goes out with the next broadcast tick
+                if self.immediate_ack:
+                    self.ack_requests.add(connection)  # gets the state after the next simulation tick
+
+    async def _write_loop(self, connection):
+        try:
+            while True:
+                await connection.wakeup.wait()
+                connection.wakeup.clear()
+                frame = connection.pop_frame()
+                while frame is not None:
+                    connection.writer.write(frame)
+                    self.stats.add_sent(len(frame))
+                    await connection.writer.drain()  # a slow client only makes its own states go stale
+                    frame = connection.pop_frame()
+        except ConnectionError:
+            pass
@@ -0,0 +1,122 @@
+"""
+Counters of the traffic of a Server or a Client, see their get_stats methods.
+The round trip time is measured by the server: it pings every client once per PING_INTERVAL
+and tells the client the last measured time with the next ping.
+"""
+import threading
+import time
+from collections import deque
+
+PING_INTERVAL = 1.0  # in s
+RATE_WINDOW = 1.0  # in s, the messages per second are counted over it
+
+
+def summarize(samples):
+    """ Returns {'p50', 'p95', 'max'} of the samples, zeros if there are none """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50': 0, 'p95': 0, 'max': 0}
+    return {'p50': ordered[len(ordered) // 2], 'p95': ordered[int(0.95 * (len(ordered) - 1))], 'max': ordered[-1]}
+
+
+class NetStats:
+    """ Updated by the network threads and read by the main thread """
+    def __init__(self, window=100):
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.sent_times = deque()  # send times of the messages within the last RATE_WINDOW
+        self.received_times = deque()
+        self.snapshot_sizes = deque(maxlen=window)  # in bytes, of the encoded states
+        self.serialize_times = deque(maxlen=window)  # in ms, packing and encoding a state for all the clients
+        self.deserialize_times = deque(maxlen=window)  # in ms, decoding a received message and applying its delta
+        self.command_latencies = deque(maxlen=window)  # in ms, from receiving a command to sending its effect
+        self.command_ticks = deque(maxlen=window)  # ticks a command has waited, 0 if it ran on the next one
+        self.rtt = None  # in ms, the last measured round trip time
+
+    @staticmethod
+    def _count(times, now, count):
+        times.extend([now] * count)
+        while times and times[0] < now - RATE_WINDOW:
+            times.popleft()
+
+    def add_sent(self, size, count=1):
+        with self.lock:
+            self.bytes_sent += size
+            self.messages_sent += count
+            self._count(self.sent_times, time.time(), count)
+
+    def add_received(self, size, count=1):
+        with self.lock:
+            self.bytes_received += size
+            self.messages_received += count
+            self._count(self.received_times, time.time(), count)
+
+    def add_snapshot(self, size):
+        with self.lock:
+            self.snapshot_sizes.append(size)
+
+    def add_serialize_time(self, ms):
+        with self.lock:
+            self.serialize_times.append(ms)
+
+    def add_deserialize_time(self, ms):
+        with self.lock:
+            self.deserialize_times.append(ms)
+
+    def add_command_latency(self, ms):
+        with self.lock:
+            self.command_latencies.append(ms)
+
+    def add_command_ticks(self, ticks):
+        with self.lock:
+            self.command_ticks.append(ticks)
+
+    def set_rtt(self, ms):
+        self.rtt = ms
+
+    def get_stats(self):
+        with self.lock:
+            now = time.time()
+            self._count(self.sent_times, now, 0)
+            self._count(self.received_times, now, 0)
+            return {
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'messages_sent': self.messages_sent,
+                'messages_received': self.messages_received,
+                'sent_per_s': len(self.sent_times) / RATE_WINDOW,
+                'received_per_s': len(self.received_times) / RATE_WINDOW,
+                'snapshot_bytes': summarize(self.snapshot_sizes),
+                'serialize_ms': summarize(self.serialize_times),
+                'deserialize_ms': summarize(self.deserialize_times),
+                'command_latency_ms': summarize(self.command_latencies),
+                'command_delay_ticks': summarize(self.command_ticks),
+                'rtt_ms': self.rtt,
+            }
+
+
+def format_stats(name, stats):
+    """ Returns the lines of text describing the stats returned by Server.get_stats or Client.get_stats """
+    def dist(summary, unit):
+        return f'{summary["p50"]:.1f}/{summary["p95"]:.1f}/{summary["max"]:.1f} {unit}'
+
+    rtt = f'{stats["rtt_ms"]:.1f} ms' if stats['rtt_ms'] is not None else '-'
+    lines = [
+        f'{name} rtt {rtt}',
+        f'  sent {stats["bytes_sent"] / 1024:.1f} kB, {stats["sent_per_s"]:.0f} msg/s',
+        f'  recv {stats["bytes_received"] / 1024:.1f} kB, {stats["received_per_s"]:.0f} msg/s',
+        f'  snapshot p50/p95/max {dist(stats["snapshot_bytes"], "B")}',
+        f'  serialize {dist(stats["serialize_ms"], "ms")}',
+        f'  deserialize {dist(stats["deserialize_ms"], "ms")}',
+    ]
+    if 'clients' in stats:  # the commands are executed by the host
+        lines.append(f'  command latency {dist(stats["command_latency_ms"], "ms")}, '
+                     f'{dist(stats["command_delay_ticks"], "ticks")}')
+    for client_id, client in sorted(stats.get('clients', {}).items()):
+        client_rtt = f'{client["rtt_ms"]:.1f} ms' if client['rtt_ms'] is not None else '-'
+        lines.append(f'  client {client_id}: backlog {client["backlog"]} msgs, {client["buffered_bytes"]} B, '
+                     f'dropped {client["dropped_states"]}, rtt {client_rtt}')
+    return lines
@@ -0,0 +1,146 @@
+"""
+Per frame profiling of the main loop.
+The main loop and the board wrap their phases in profiler.section(name). While the profiler is enabled
+the time spent in every section is summed per frame and kept in a rolling window, so the percentiles show
+whether a frame spike comes from the simulation catching up or from rendering.
+"""
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import pygame as pg
+
+PERCENTILES = (50, 95, 99)
+_NO_SECTION = nullcontext()  # shared by the sections while the profiler is disabled, it's reusable
+_font = None
+
+
+def render_lines(lines, **position):
+    """
+    Renders the lines of text on an opaque surface, so drawing it every frame over the dirty rect rendering
+    doesn't accumulate. The position is passed to get_rect, e.g. topleft=(5, 5). Returns (surface, rect)
+    """
+    global _font
+    if _font is None:
+        _font = pg.font.SysFont('monospace', 13)
+    rendered = [_font.render(line, True, pg.Color('white')) for line in lines]
+    line_height = _font.get_linesize()
+    surface = pg.Surface((max(r.get_width() for r in rendered) + 10, line_height * len(rendered) + 10))
+    for i, text in enumerate(rendered):
+        surface.blit(text, (5, 5 + i * line_height))
+    return surface, surface.get_rect(**position)
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class FrameProfiler:
+    def __init__(self, window=300, log_interval=60):
+        self.enabled = False
+        self.show_overlay = False
+        self.window = window  # number of frames the percentiles are computed from
+        self.log_interval = log_interval  # frames between two log file entries
+        self.frame_samples = {}  # section name -> deque of ms per frame
+        self.call_samples = {}  # section name -> deque of ms per single call (e.g. per fixed-step update)
+        self.current = {}  # section name -> ms spent in it during the current frame
+        self.frame_no = 0
+        self.log_file = None
+        self.overlay = None  # rendered (surface, rect)
+
+    def enable(self, log_path=None):
+        self.enabled = True
+        if log_path and not self.log_file:
+            self.log_file = open(log_path, 'a')
+
+    def disable(self):
+        self.enabled = False
+        self.show_overlay = False
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        self.enabled = self.show_overlay or self.log_file is not None  # keep measuring only for the log
+
+    def section(self, name):
+        """
+        Measures the time spent inside the with block and adds it to the current frame.
+        While the profiler is disabled it's a flag check returning a shared no-op context
+        """
+        if not self.enabled:
+            return _NO_SECTION
+        return self._timed_section(name)
+
+    @contextmanager
+    def _timed_section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.current[name] = self.current.get(name, 0.0) + elapsed
+            self.call_samples.setdefault(name, deque(maxlen=self.window)).append(elapsed)
+
+    def add_sample(self, name, value):
+        """ Adds a value (e.g. the number of updates) to the current frame """
+        if self.enabled:
+            self.current[name] = self.current.get(name, 0.0) + value
+
+    def end_frame(self):
+        """ Pushes the current frame's totals to the rolling windows. Called once per main loop iteration """
+        if not self.enabled:
+            return
+        for name in self.frame_samples.keys() | self.current.keys():
+            samples = self.frame_samples.setdefault(name, deque(maxlen=self.window))
+            samples.append(self.current.get(name, 0.0))
+        self.current = {}
+        self.frame_no += 1
+        if self.log_file and self.frame_no % self.log_interval == 0:
+            self.write_log()
+        if self.show_overlay and (self.overlay is None or self.frame_no % 30 == 0):
+            self.render_overlay()
+
+    def get_stats(self, per_call=False):
+        """ Returns {section name: {'p50': ms, 'p95': ms, 'p99': ms, 'max': ms}} """
+        stats = {}
+        for name, samples in (self.call_samples if per_call else self.frame_samples).items():
+            ordered = sorted(samples)
+            stats[name] = {f'p{p}': percentile(ordered, p) for p in PERCENTILES}
+            stats[name]['max'] = ordered[-1] if ordered else 0.0
+        return stats
+
+    def write_log(self):
+        entry = {
+            'time': time.time(),
+            'frame': self.frame_no,
+            'per_frame': self.get_stats(),
+            'per_call': self.get_stats(per_call=True),
+        }
+        self.log_file.write(json.dumps(entry) + '\n')
+        self.log_file.flush()
+
+    def render_overlay(self):
+        lines = [f'{"section":<16}{"p50":>7}{"p95":>7}{"p99":>7}{"max":>7}']
+        per_step = self.get_stats(per_call=True).get('update')
+        for name, stat in sorted(self.get_stats().items()):
+            lines.append(f'{name:<16}' + ''.join(f'{stat[key]:>7.2f}' for key in ('p50', 'p95', 'p99', 'max')))
+            if name == 'update' and per_step:
+                lines.append(f'{"update (step)":<16}' + ''.join(f'{per_step[key]:>7.2f}'
+                                                                 for key in ('p50', 'p95', 'p99', 'max')))
+        self.overlay = render_lines(lines, topleft=(5, 5))
+
+    def draw_overlay(self, surface):
+        """ Draws the percentiles table. Returns its rect or None if nothing was drawn """
+        if self.show_overlay and self.overlay:
+            surface.blit(*self.overlay)
+            return self.overlay[1]
+        return None
+
+
+profiler = FrameProfiler()  # shared by the main loop and the board
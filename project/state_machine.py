@@ -32,7 +32,8 @@ class StateMachine:
         self.state.update(keys, now)
 
     def draw(self, surface, interpolate):
-        self.state.draw(surface, interpolate)
+        """ Returns the list of rects the state has changed, None if the whole surface has to be updated """
+        return self.state.draw(surface, interpolate)
 
     def flip_state(self):
         """
@@ -2,13 +2,16 @@ from typing import Optional, Dict
 import pygame as pg
 
 from project.dataclasses import GameData
-from project import state_machine, colors
+from project import state_machine, colors, config, tools
+from project.states.net_overlay import render_network_overlay
 from project.components import board, UI, Player
-from project.networking import Client, Server, Receiver, Packable
+from project.networking import Client, Server, Receiver, Packable, lockstep
 
 
 class Game(state_machine.State, Packable, Receiver):
     """Core state for the actual gameplay."""
+    state_schema = 'game'  # how the server encodes the state, see networking.codec
+
     def __init__(self):
         state_machine.State.__init__(self)
         self.board = board.Board(self)
@@ -17,6 +20,14 @@ class Game(state_machine.State, Packable, Receiver):
         self.is_over: bool = False
         self.server: Optional[Server] = None  # if is not None, the game is online, and this Game is the host
         self.client: Optional[Client] = None  # if is not None, the game is online, and this Game is a client
+        self.lockstep = False  # every peer simulates the game from the commands relayed by the server
+        self.tick_bundles = lockstep.TickBundles()  # the received commands waiting for their tick
+        self.desync_tick = None  # the first tick the peers' states have differed on
+        self.background: Optional[pg.Surface] = None  # UI, markers and the static part of the board
+        self.marker_rects: Dict[int, pg.Rect] = {}  # player id -> rect of the marker on the background
+        self.dynamic_rects = []  # rects drawn over the background during the last frame
+        self.net_overlay = None  # rendered network stats (surface, rect), F7 shows them while online
+        self.net_overlay_time = 0  # when were the network stats rendered
 
     def startup(self, now, persistent):
         self.is_over = False
@@ -25,8 +36,14 @@ class Game(state_machine.State, Packable, Receiver):
             raise IndexError('GAME startup: game_data key not present in the persistent dictionary.')
         settings = persistent['game_data']
         self.client, self.server = settings.client, settings.server
-        if self.server:
-            self.server.set_state_source(self, 0.3)
+        self.lockstep = settings.lockstep and self.client is not None
+        self.tick_bundles.clear()
+        self.desync_tick = None
+        if self.server and self.lockstep:
+            self.server.start_lockstep(tools.TIME_PER_UPDATE / 1000)
+        elif self.server:
+            self.server.set_state_source(self, config.STATE_BROADCAST_DELAY, config.STATE_BROADCAST_TICK,
+                                         config.STATE_IMMEDIATE_ACK)
         if self.client:
             self.client.receiver = self
             for p in self.players.values():
@@ -35,7 +52,10 @@ class Game(state_machine.State, Packable, Receiver):
                     p.is_online = True
 
         self.players = self.board.initialize(settings.map)
-        self.UI = UI(self.players)
+        self.board.is_replica = self.client is not None and self.server is None and not self.lockstep
+        self.UI = UI(self.players) if not config.HEADLESS else None  # nothing to show it on while headless
+        if self.lockstep:
+            self.client.send('ready')  # the server starts sealing the ticks once everyone is ready
 
     def cleanup(self):
         if self.client and self.client.running:
@@ -47,6 +67,9 @@ class Game(state_machine.State, Packable, Receiver):
         return super().cleanup()
 
     def get_event(self, event):
+        if event.type == pg.KEYDOWN and event.key == pg.K_F7 and self.client:
+            self.net_overlay = None if self.net_overlay else render_network_overlay(self.client, self.server,
+                                                                                    topright=(config.WIDTH - 5, 5))
         if event.type == pg.KEYDOWN or event.type == pg.JOYBUTTONDOWN:
             if not event.type == pg.JOYBUTTONDOWN and event.key == pg.K_ESCAPE:
                 self.board.clear()
@@ -56,7 +79,9 @@ class Game(state_machine.State, Packable, Receiver):
                 comm = p.get_command_from_event(event)
                 # send what you want to do to the server, and execute it when the servers responds
                 if comm is not None and not self.is_over:
-                    if self.client :
+                    if self.client and self.lockstep:  # every peer executes it at the same tick
+                        self.client.send(f'action:{comm}:{self.board.tick + config.LOCKSTEP_INPUT_DELAY}')
+                    elif self.client:
                         self.client.send(f'action:{comm}')
                     else:  # playing offline, just execute the command
                         p.execute_command(comm)
@@ -69,13 +94,51 @@ class Game(state_machine.State, Packable, Receiver):
             # else it's a spectator mashing buttons
         elif message[0] == 'state' and self.server is None:  # the state owner doesnt care about the state message
             self.unpack(message[1])
+        elif message[0] == 'ticks':  # lockstep bundles, executed by update
+            for tick, commands in message[1]:
+                self.tick_bundles.put(tick, commands)
+        elif message[0] == 'desync':
+            print(f'The game has desynced at tick {message[1]}')
+            self.desync_tick = message[1]
 
     def update(self, keys, now):
         """Update phase for the primary game state."""
+        if self.client:
+            self.client.poll()  # the received state is applied between the ticks
+        if self.server and not self.lockstep:
+            self.execute_received_commands()
+        if self.net_overlay and now - self.net_overlay_time >= config.NET_OVERLAY_REFRESH:
+            self.net_overlay_time = now
+            self.net_overlay = render_network_overlay(self.client, self.server, topright=(config.WIDTH - 5, 5))
         if not self.is_over:
             self.is_over = self._is_over()
-            self.UI.update()
-            self.board.update(now)
+            if self.UI:
+                self.UI.update()
+            if self.lockstep:
+                self.step_lockstep()
+            else:
+                self.board.update()
+        if self.server:
+            self.server.update_state(self.board.tick)  # the snapshot is taken on the tick boundary
+
+    def execute_received_commands(self):
+        """ Executes the players' actions received by the server before the tick, in the order of arrival """
+        for player_id, command, arrival_time, arrival_tick in self.server.pop_commands():
+            self.handle_message(('action', player_id, command))
+            self.server.command_executed(arrival_time, arrival_tick, self.board.tick)
+
+    def step_lockstep(self):
+        """ Advances the board through the ticks whose bundles have arrived, a few at most """
+        for _ in range(config.LOCKSTEP_MAX_CATCHUP):
+            commands = self.tick_bundles.pop(self.board.tick + 1)
+            if commands is None:  # waiting for the server
+                return
+            for player_id, command in commands:
+                if player_id in self.players:  # else it's a spectator mashing buttons
+                    self.players[player_id].execute_command(command)
+            self.board.update()
+            if self.board.tick % config.LOCKSTEP_CHECKSUM_INTERVAL == 0:
+                self.client.send(f'checksum:{self.board.tick}:{lockstep.state_checksum(self)}')
 
     def get_winner(self):
         """
@@ -100,17 +163,72 @@ class Game(state_machine.State, Packable, Receiver):
         return still_playing <= 1
 
     def draw(self, surface, interpolate):
-        """Draw level and sidebar; if player is dead draw death sequence."""
+        """
+        Draws only what has changed since the last frame. Returns the list of changed rects.
+        The UI, the markers, the tiles, the paths and the buildings are kept on the background. Their changed areas
+        are redrawn on it and copied to the screen. The soldiers, bullets and menus are drawn over the background
+        every frame, and their last frame's rects are restored from it.
+        Returns None if the whole screen was redrawn
+        """
+        if self.background is None:
+            self.background = pg.Surface(surface.get_size()).convert()
+        if self.dirty:
+            self.dirty = False
+            self.board.collect_dirty_rects()  # everything is drawn anyway
+            self.UI.pop_dirty_rects()
+            self.collect_marker_rects()
+            self.draw_background(self.background)
+            surface.blit(self.background, (0, 0))
+            self.dynamic_rects = self.draw_dynamic(surface, interpolate)
+            return None
+
+        changed = self.board.collect_dirty_rects() + self.UI.pop_dirty_rects() + self.collect_marker_rects()
+        # every redraw goes through all the static sprites, so the rects are merged to redraw only a few areas
+        changed = tools.merge_rects(changed, config.MAX_BACKGROUND_REDRAWS)
+        for rect in changed:
+            self.background.set_clip(rect)
+            self.draw_background(self.background)
+        self.background.set_clip(None)
+
+        restored = self.dynamic_rects + changed
+        for rect in restored:
+            surface.blit(self.background, rect, rect)
+        self.dynamic_rects = self.draw_dynamic(surface, interpolate)
+        return restored + self.dynamic_rects
+
+    def draw_background(self, surface):
         surface.fill(colors.WHITE)
         self.UI.draw(surface)
         for p in self.players.values():
             p.draw_marker(surface)
-        self.board.draw(surface, interpolate)
+        self.board.draw_static(surface)
+
+    def draw_dynamic(self, surface, interpolate):
+        """ Draws the parts changing every frame. Returns the list of rects drawn on """
+        rects = self.board.draw_dynamic(surface, interpolate)
         for p in self.players.values():
             if not p.is_online:
-                p.draw_menu(surface)
+                rect = p.draw_menu(surface)
+                if rect:
+                    rects.append(rect)
         if self.is_over:
-            self.UI.show_winner(surface, self.get_winner())
+            rects.append(self.UI.show_winner(surface, self.get_winner()))
+        if self.net_overlay:
+            rects.append(surface.blit(*self.net_overlay))
+        return rects
+
+    def collect_marker_rects(self):
+        """ Returns the old and the new rects of the markers which have moved since the last call """
+        rects = []
+        for p in self.players.values():
+            rect = p.marker.image.get_rect(center=p.tile.rect.center)
+            old_rect = self.marker_rects.get(p.id)
+            if old_rect != rect:
+                rects.append(rect)
+                if old_rect:
+                    rects.append(old_rect)
+                self.marker_rects[p.id] = rect
+        return rects
 
     def pack(self):
         return {
@@ -39,4 +39,4 @@ class Menu(state_machine.State):
             self.persist = self.state_machine.state.persist
 
     def draw(self, surface, interpolate):
-        self.state_machine.draw(surface, interpolate)
+        return self.state_machine.draw(surface, interpolate)
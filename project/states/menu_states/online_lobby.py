@@ -1,16 +1,18 @@
-import pickle
 from typing import Optional, Dict, List
 import time
 
 import pygame as pg
 from project import menu_utils, config, colors
-from project.dataclasses import GameData
+from project.dataclasses import GameData, MapConfig
 from project.menu_utils import BasicMenu, BoardPreview
-from project.networking import Server, ClientData, Client, Receiver, Packable
+from project.networking import Server, ClientData, Client, Receiver, Packable, codec
+from project.states.net_overlay import render_network_overlay
 
 
 class OnlineLobby(BasicMenu, Packable, Receiver):
     """Players connect and wait choose the settings before the game begins"""
+    state_schema = 'lobby'  # how the server encodes the state, see networking.codec
+
     def __init__(self):
         super().__init__(2)
         self.image = pg.Surface(config.SCREEN_SIZE).convert()
@@ -25,6 +27,8 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
         self.client: Optional[Client] = None
         self.is_host: bool = False
         self.preserve_network = False  # should the server and client be preserved when changing the state
+        self.net_overlay = None  # rendered network stats (surface, rect), F7 shows them
+        self.net_overlay_time = 0  # when were the network stats rendered
         self.render()
 
     def startup(self, now, persistent):
@@ -34,6 +38,7 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
         :param persistent: dict with keys:
             'is_host' -> should the server be created
             'ip' -> ignored is 'is_host'  the server is not created and the client connects to the specified ip
+            'match' -> optional, the ip is a match server's and the client joins this match
             'player_name' -> client's name
         """
         print(f'Received persistent: {persistent}')
@@ -55,7 +60,7 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
             self.persist.update({'notification': None})  # clear the notification - all is good
         else:
             self.is_host = False
-            self.client = Client(self, persistent['player_name'], persistent['ip'])
+            self.client = Client(self, persistent['player_name'], persistent['ip'], match=persistent.get('match'))
             if not self.client.running:
                 self.next = 'ONLINE_MODE_SELECT'
                 self.persist.update({'notification': 'Could not connect to the server {}'.format(persistent['ip'])})
@@ -77,7 +82,7 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
     def render_players(self, clients: List[Optional[ClientData]]):
         center_x, center_y = config.SCREEN_RECT.center
         strings = [f'{c.id}. {c.name[:10]} - {c.address[0]}' for c in clients if c]
-        cols = [config.PLAYER_COLORS[c.id] for c in clients if c]
+        cols = [config.PLAYER_COLORS.get(c.id, colors.BLACK) for c in clients if c]  # spectators have no color
         args = [config.FONT_SMALL, strings, cols, center_y * 0.38, 35, True, center_x * 1.48]
         self.rendered['players'] = menu_utils.make_text_list(*args)
 
@@ -102,20 +107,34 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
         self.rendered['players'] = []
 
     def handle_message(self, message):
-        if message[0] == 'init':  # ['init', map:MapConfig]
-            self.start_game(message[1])
+        if message[0] == 'init':  # ['init', (player_no, map name, map layout), lockstep]
+            self.start_game(MapConfig(*message[1]), message[2])
         elif message[0] == 'state':
             self.unpack(message[1])  # ['state', state_data: Dict]
 
     def get_event(self, event):
         super().get_event(event)
+        if event.type == pg.KEYDOWN and event.key == pg.K_F7 and self.client:
+            self.net_overlay = None if self.net_overlay else render_network_overlay(self.client, self.server,
+                                                                                    topleft=(5, 5))
+            self.dirty = True
         if self.server and event.type == pg.KEYDOWN:
             if event.key == pg.K_a:
                 self.board_preview.change_map(-1)
-                self.server.send_state()
+                self.server.state_changed = True
             elif event.key == pg.K_d:
                 self.board_preview.change_map(1)
-                self.server.send_state()
+                self.server.state_changed = True
+
+    def update(self, keys, now):
+        if self.client:
+            self.client.poll()
+        if self.server:
+            self.server.update_state()
+        if self.net_overlay and now - self.net_overlay_time >= config.NET_OVERLAY_REFRESH:
+            self.net_overlay_time = now
+            self.net_overlay = render_network_overlay(self.client, self.server, topleft=(5, 5))
+            self.dirty = True
 
     def pressed_exit(self):
         self.next = 'MAIN'
@@ -142,6 +161,8 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
             buttons = self.rendered['buttons']
             text, rect = buttons[state][i]
             self.image.blit(text, rect)
+        if self.net_overlay:
+            self.image.blit(*self.net_overlay)
         screen.blit(self.image, self.image.get_rect())
 
     def pressed_enter(self):
@@ -150,19 +171,19 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
                 map_config = self.board_preview.get_map_config()
                 self.persist.update({
                     'game_data': GameData(server=self.server, client=self.client,
-                                          map=map_config)
+                                          map=map_config, lockstep=config.LOCKSTEP)
                 })
-                # self.server.send_to_all(pickle.dumps({'stats': building_stats.get_stats_dict()}))
-                self.server.send_to_clients(pickle.dumps(['init', map_config]))
+                self.server.clear_state_source()  # no lobby state may follow the init
+                self.server.send_to_clients(codec.encode_init(map_config, config.LOCKSTEP))
                 self.preserve_network = True
                 self.quit = True  # leave the menu state manager and start the game
         elif self.index == 1:  # back button
             self.next = 'ONLINE_MODE_SELECT'
             self.done = True
 
-    def start_game(self, map_config):
+    def start_game(self, map_config, lockstep=False):
         self.persist.update({
-            'game_data': GameData(server=self.server, client=self.client, map=map_config),
+            'game_data': GameData(server=self.server, client=self.client, map=map_config, lockstep=lockstep),
         })
         self.preserve_network = True
         self.quit = True  # leave the menu state manager and start the game
@@ -172,7 +193,7 @@ class OnlineLobby(BasicMenu, Packable, Receiver):
             return {}
         return {
             'map_index': self.board_preview.map_index,
-            'clients': self.server.clients
+            'clients': self.server.clients,
         }
 
     def unpack(self, data):
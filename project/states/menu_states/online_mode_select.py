@@ -99,7 +99,8 @@ class OnlineModeSelect(BasicMenu):
             if self.index == 0:
                 self.persist = {'is_host': True}
             elif self.index == 1:
-                self.persist = {'is_host': False, 'ip': self.address_field.content}
+                ip, _, match = self.address_field.content.partition('/')  # "ip/match_id" joins a match server
+                self.persist = {'is_host': False, 'ip': ip, 'match': match or None}
             self.persist.update({'player_name': self.name_field.content})
             self.next = 'ONLINE_LOBBY'
             self.done = True
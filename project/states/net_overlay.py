@@ -0,0 +1,15 @@
+"""
+The network stats overlay of the online states, toggled with F7.
+"""
+from project.networking.stats import format_stats
+from project.profiling import render_lines
+
+
+def render_network_overlay(client, server, **position):
+    """ Renders the traffic stats of the server (if hosting) and of the client, see profiling.render_lines """
+    lines = []
+    if server:
+        lines += format_stats('server', server.get_stats())
+    if client:
+        lines += format_stats('client', client.get_stats())
+    return render_lines(lines, **position)
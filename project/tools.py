@@ -1,9 +1,12 @@
 import os
+import math
 import pygame as pg
 import threading
 from project import state_machine, config
+from project.profiling import profiler
 
 TIME_PER_UPDATE = 16.0  # ~= 1000ms/60f = 62.5fps
+TICKS_PER_SECOND = 1000.0 / TIME_PER_UPDATE  # the simulation advances by one tick per update
 
 
 class Control(object):
@@ -22,6 +25,8 @@ class Control(object):
         self.now = 0.0
         self.keys = pg.key.get_pressed()
         self.state_machine = state_machine.StateMachine()
+        if config.PROFILE_LOG_PATH:
+            profiler.enable(log_path=config.PROFILE_LOG_PATH)
 
     def update(self):
         """Updates the currently active state."""
@@ -30,14 +35,19 @@ class Control(object):
 
     def draw(self, interpolate):
         if not self.state_machine.state.done:
-            self.state_machine.draw(self.screen, interpolate)
-            pg.display.update()
+            dirty_rects = self.state_machine.draw(self.screen, interpolate)
+            overlay_rect = profiler.draw_overlay(self.screen)
+            if dirty_rects is None:
+                pg.display.update()
+            else:
+                pg.display.update(dirty_rects + [overlay_rect] if overlay_rect else dirty_rects)
             self.show_fps()
 
     def event_loop(self):
         """
         Process all events and pass them down to the state_machine.
         The f5 key globally turns on/off the display of FPS in the caption
+        The f6 key globally turns on/off the profiler overlay
         """
         for event in pg.event.get():
             if event.type == pg.QUIT:
@@ -46,6 +56,7 @@ class Control(object):
             elif event.type == pg.KEYDOWN:
                 self.keys = pg.key.get_pressed()
                 self.toggle_show_fps(event.key)
+                self.toggle_profiler_overlay(event.key)
             elif event.type == pg.KEYUP:
                 self.keys = pg.key.get_pressed()
             self.state_machine.get_event(event)
@@ -57,6 +68,12 @@ class Control(object):
             if not self.fps_visible:
                 pg.display.set_caption(self.caption)
 
+    def toggle_profiler_overlay(self, key):
+        """Press f6 to turn on/off the frame profiler's overlay."""
+        if key == pg.K_F6:
+            profiler.toggle_overlay()
+            self.state_machine.state.dirty = True  # redraw the area under the hidden overlay
+
     def show_fps(self):
         """ Display the current FPS in the window handle if fps_visible is True."""
         if self.fps_visible:
@@ -69,11 +86,18 @@ class Control(object):
         lag = 0.0
         while not self.done:
             lag += self.clock.tick(self.fps)
-            self.event_loop()
+            with profiler.section('event_loop'):
+                self.event_loop()
+            steps = 0
             while lag >= TIME_PER_UPDATE:
-                self.update()
+                with profiler.section('update'):
+                    self.update()
                 lag -= TIME_PER_UPDATE
-            self.draw(lag / TIME_PER_UPDATE)
+                steps += 1
+            profiler.add_sample('steps/frame', steps)
+            with profiler.section('draw'):
+                self.draw(lag / TIME_PER_UPDATE)
+            profiler.end_frame()
 
 
 # Resource loading functions.
@@ -98,6 +122,24 @@ def load_all_gfx(directory, colorkey, accept=(".png", ".jpg", ".bmp")):
     return graphics
 
 
+_sprite_cache = {}
+
+
+def get_sprite(directory, name, size, flip=False):
+    """
+    Returns the config.gfx[directory][name] graphic scaled to the size and optionally flipped horizontally.
+    Scaled surfaces are cached and shared by all the components, so they must not be drawn on.
+    """
+    key = (directory, name, tuple(size), flip)
+    sprite = _sprite_cache.get(key)
+    if sprite is None:
+        sprite = pg.transform.scale(config.gfx[directory][name], key[2])
+        if flip:
+            sprite = pg.transform.flip(sprite, True, False)
+        _sprite_cache[key] = sprite
+    return sprite
+
+
 def set_interval(func, sec):
     def func_wrapper():
         set_interval(func, sec)
@@ -108,6 +150,29 @@ def set_interval(func, sec):
     return t
 
 
+def seconds_to_ticks(seconds):
+    """ Converts a delay to the number of simulation ticks (at least one) """
+    return max(1, round(seconds * TICKS_PER_SECOND))
+
+
+def merge_rects(rects, limit):
+    """
+    Merges the overlapping and touching rects, so the area they share is drawn once.
+    If more than limit rects are left, returns their single union
+    """
+    merged = []
+    for rect in rects:
+        rect = pg.Rect(rect)
+        index = rect.inflate(2, 2).collidelist(merged)
+        while index != -1:  # the grown rect may now touch the rects merged before
+            rect.union_ip(merged.pop(index))
+            index = rect.inflate(2, 2).collidelist(merged)
+        merged.append(rect)
+    if len(merged) > limit:
+        return [merged[0].unionall(merged[1:])]
+    return merged
+
+
 def dist_sq(pos1, pos2):
     x1, y1 = pos1
     x2, y2 = pos2
@@ -131,26 +196,40 @@ def pos_to_absolute(pos):
     return pos[0]*config.WIDTH, pos[1]*config.HEIGHT
 
 
+HEALTH_BAR_STEPS = 20  # number of distinct health bar lengths
+_health_bar_cache = {}
+
+
 def get_health_surface(health_ratio, width, height):
-    health_ratio = max(0, health_ratio)
-    health_img = pg.Surface((int(health_ratio*width), int(height)))
-    col = [250 * (1 - health_ratio), health_ratio * 250, 0]
-    health_img.fill(col)
+    """
+    Returns the health bar for the given ratio.
+    The ratio is quantized to HEALTH_BAR_STEPS steps (rounded up, so a living unit never shows an empty bar)
+    and the bars are cached per size, so the returned surface is shared and must not be drawn on.
+    """
+    step = math.ceil(min(1, max(0, health_ratio)) * HEALTH_BAR_STEPS)
+    key = (step, int(width), int(height))
+    health_img = _health_bar_cache.get(key)
+    if health_img is None:
+        health_ratio = step / HEALTH_BAR_STEPS
+        health_img = pg.Surface((int(health_ratio*width), int(height)))
+        col = [250 * (1 - health_ratio), health_ratio * 250, 0]
+        health_img.fill(col)
+        _health_bar_cache[key] = health_img
     return health_img
 
 
 class Animation:
-    """Simplifies animation handling"""
+    """Simplifies animation handling. Driven by the simulation ticks, not by the wall time"""
     def __init__(self, frames, fps):
         self.frames = frames
         self.fps = fps
         self.frame = 0
-        self.timer = None
+        self.timer = None  # tick of the last frame change
 
-    def get_next_frame(self, now):
-        if not self.timer:
-            self.timer = now
-        if now - self.timer > 1000.0 / self.fps:
+    def get_next_frame(self, tick):
+        if self.timer is None:
+            self.timer = tick
+        if tick - self.timer > TICKS_PER_SECOND / self.fps:
             self.frame = (self.frame + 1) % len(self.frames)
-            self.timer = now
+            self.timer = tick
         return self.frames[self.frame]
@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the project is imported headless: no display, no fonts, the graphics are listed but not decoded
+os.environ['RTS_HEADLESS'] = '1'
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # the resources are loaded relative to the repository's root
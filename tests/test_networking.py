@@ -0,0 +1,216 @@
+"""
+Deterministic checks of the network layer: framing, table deltas, the binary codec and the lockstep relay.
+"""
+from collections import OrderedDict
+
+import pytest
+
+from project import config
+from project.components import Path
+from project.dataclasses import GameData, MapConfig
+from project.networking import Client, ClientData, codec, delta, lockstep
+from project.networking.framing import FrameBuffer, FramingError, encode_frame
+from project.states.game import Game
+
+
+def make_map_config(player_no=2):
+    name = next(iter(config.MAPS))
+    return MapConfig(player_no=player_no, name=name, layout=config.MAPS[name])
+
+
+# framing
+
+def test_frame_buffer_reassembles_split_frames():
+    data = encode_frame(b'hello') + encode_frame(b'') + encode_frame(b'world' * 100)
+    frames = FrameBuffer()
+    received = []
+    for i in range(len(data)):  # worst case, one byte at a time
+        frames.feed(data[i:i + 1])
+        received += frames.pop_all()
+    assert received == [b'hello', b'', b'world' * 100]
+    assert not frames.buffer
+
+
+def test_frame_buffer_splits_joined_frames():
+    frames = FrameBuffer()
+    frames.feed(encode_frame(b'a') + encode_frame(b'bc') + encode_frame(b'def')[:3])
+    assert frames.pop_all() == [b'a', b'bc']
+    frames.feed(encode_frame(b'def')[3:])
+    assert frames.pop() == b'def'
+    assert len(frames) == 0
+
+
+def test_frame_buffer_rejects_oversized_frames():
+    frames = FrameBuffer(max_frame_size=10)
+    with pytest.raises(FramingError):
+        frames.feed(encode_frame(b'x' * 11))
+
+
+# deltas
+
+def lobby_table(map_index, *names):
+    clients = [ClientData(id=i + 1, name=name, address=('10.0.0.1', 5000 + i)) for i, name in enumerate(names)]
+    return codec.get_schema('lobby').to_table({'map_index': map_index, 'clients': clients})
+
+
+def test_delta_round_trip_against_older_baseline():
+    baseline = lobby_table(0, 'ann', 'bob', 'cid')
+    lobby_table(1, 'ann', 'bob')  # an intermediate state the client hasn't acknowledged
+    newest = lobby_table(2, 'ann', 'dan')
+
+    table_delta = delta.diff(baseline, newest)
+    assert delta.apply(baseline, table_delta) == newest
+    assert set(table_delta['clients'][1]) == {3}  # removed
+    assert baseline == lobby_table(0, 'ann', 'bob', 'cid')  # the baseline is untouched
+
+
+def test_delta_of_equal_tables_is_empty():
+    assert delta.diff(lobby_table(3, 'ann'), lobby_table(3, 'ann')) == {}
+
+
+class RecordingClient(Client):
+    """ A Client with no connection, remembers what it would send """
+    def __init__(self):
+        self.states = OrderedDict()
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+def encode_and_decode_state(schema, seq, base_seq, table_delta):
+    return codec.decode_message(codec.encode_state(schema, seq, base_seq, table_delta))
+
+
+def test_client_resolves_delta_against_acknowledged_baseline():
+    schema = codec.get_schema('lobby')
+    client = RecordingClient()
+    first, second = lobby_table(0, 'ann'), lobby_table(1, 'ann', 'bob')
+
+    _, state = client.resolve_state(encode_and_decode_state(schema, 1, 0, delta.diff(schema.empty_table(), first)))
+    assert client.sent == ['ack:1']
+    assert state['map_index'] == 0
+
+    _, state = client.resolve_state(encode_and_decode_state(schema, 2, 1, delta.diff(first, second)))
+    assert client.sent[-1] == 'ack:2'
+    assert state['map_index'] == 1
+    assert [c.name for c in state['clients']] == ['ann', 'bob']
+
+
+def test_client_asks_for_whole_state_on_unknown_baseline():
+    schema = codec.get_schema('lobby')
+    client = RecordingClient()
+    message = encode_and_decode_state(schema, 7, 5, delta.diff(lobby_table(0, 'ann'), lobby_table(1, 'ann')))
+    assert client.resolve_state(message) is None
+    assert client.sent == ['ack:0']
+
+
+# codec
+
+def decode_records(schema, table_delta):
+    """ The delta as decode_message returns it, with every record decoded """
+    return {section: ({key: schema.decode_record(section, key, record, 0) for key, record in changed.items()},
+                      removed)
+            for section, (changed, removed) in table_delta.items()}
+
+
+def test_state_message_round_trip():
+    schema = codec.get_schema('lobby')
+    table_delta = delta.diff(lobby_table(0, 'ann', 'bob'), lobby_table(4, 'ann', 'eve'))
+    assert encode_and_decode_state(schema, 9, 8, table_delta) == (
+        'state', schema, 9, 8, decode_records(schema, table_delta))
+
+
+def test_game_state_round_trip():
+    game = start_game()
+    player = game.players[1]
+    tile = next(tile for tile in player.tile.neighbours.values()
+                if tile is not None and tile.owner is player and tile.building is None)
+    game.board.build_on_tile(tile, 'barracks')
+    tile.building.health = tile.building.max_health
+    path = Path(tile, player)
+    path.add_tile(next(t for t in tile.neighbours.values() if t is not None and t is not player.tile))
+    tile.building.set_path(path)
+    for _ in range(300):  # let the barracks spawn a soldier
+        game.board.update()
+    schema = codec.get_schema('game')
+    table = schema.to_table(game.pack())
+    assert table['paths'] and table['soldiers']
+    _, _, _, _, decoded_delta = encode_and_decode_state(schema, 1, 0, delta.diff(schema.empty_table(), table))
+    state = schema.from_table(delta.apply(schema.empty_table(), decoded_delta))
+    assert schema.to_table(state) == table  # nothing is lost but the quantization, which is stable
+
+
+def test_init_message_round_trip():
+    map_config = make_map_config(3)
+    assert codec.decode_message(codec.encode_init(map_config, True)) == (
+        'init', (3, map_config.name, map_config.layout), True)
+
+
+def test_ticks_message_round_trip():
+    bundles = [(5, [(1, 'up'), (2, 'action')]), (6, []), (7, [(1, 'left')])]
+    assert codec.decode_message(codec.encode_ticks(bundles)) == ('ticks', bundles)
+
+
+def test_desync_message_round_trip():
+    assert codec.decode_message(codec.encode_desync(1234)) == ('desync', 1234)
+
+
+def test_ping_message_round_trip():
+    assert codec.decode_message(codec.encode_ping(12.5, 3.25)) == ('ping', 12.5, 3.25)
+    assert codec.decode_message(codec.encode_ping(12.5, None)) == ('ping', 12.5, None)
+
+
+def test_malformed_messages_raise_codec_error():
+    with pytest.raises(codec.CodecError):
+        codec.decode_message(b'\xff')
+    with pytest.raises(codec.CodecError):
+        codec.decode_message(codec.encode_init(make_map_config())[:4])
+
+
+# lockstep
+
+def test_input_relay_seals_ticks_in_order():
+    relay = lockstep.InputRelay([1, 2])
+    relay.add_input(2, 'up', 3)
+    relay.add_input(1, 'left', 2)
+    relay.add_input(1, 'action', 3)
+    relay.add_input(2, 'right')  # no tick, the first unsealed one
+    assert relay.seal(3) == [(1, [(2, 'right')]), (2, [(1, 'left')]), (3, [(2, 'up'), (1, 'action')])]
+    assert relay.seal(3) == []
+
+    relay.add_input(1, 'down', 2)  # too late for its tick
+    assert relay.seal(4) == [(4, [(1, 'down')])]
+
+
+def test_input_relay_detects_desync_once():
+    relay = lockstep.InputRelay([1, 2])
+    assert not relay.add_checksum(1, 60, 111)
+    assert not relay.add_checksum(2, 60, 111)
+    assert relay.add_checksum(2, 120, 222) is False
+    assert relay.add_checksum(1, 120, 333)
+    assert relay.desync_tick == 120
+    assert not relay.add_checksum(1, 180, 1)
+
+
+def start_game():
+    game = Game()
+    game.startup(0, {'game_data': GameData(server=None, client=None, map=make_map_config())})
+    return game
+
+
+def test_state_checksums_match_for_same_inputs():
+    script = {10: 'action', 20: 'up', 30: 'action', 40: 'left', 60: 'down'}  # build something, walk around
+    games = [start_game(), start_game()]
+    checksums = []
+    for game in games:
+        for tick in range(1, 400):
+            for player in game.players.values():
+                if tick in script:
+                    player.execute_command(script[tick])
+            game.board.update()
+        checksums.append(lockstep.state_checksum(game))
+    assert checksums[0] == checksums[1]
+
+    games[1].players[1].gold += 1
+    assert lockstep.state_checksum(games[1]) != checksums[0]